@@ -0,0 +1,166 @@
+﻿"""
+    Бенчмарк вычислительного ядра (compute_service) на графах generate_random_tasks.
+
+    Для каждой конфигурации (число задач × плотность max_preds × max_resource) в одном процессе меряем:
+    - topo_per_sec — _random_topo_order в секунду,
+    - makespan_per_sec — _makespan_for_order в секунду,
+    - iterations_per_sec_per_core — полная симуляция (порядок + makespan) в секунду на одном ядре,
+    - ipc_bytes_per_iteration — сколько байт уходит через pickle на одну симуляцию при порции chunksize.
+    Для опорной конфигурации каждого размера (max_preds=3, max_resource=10) — run_simulations
+    с разным числом процессов: пропускная способность, эффективность масштабирования
+    (throughput / (workers * одноядерная скорость)) и доля накладных расходов пула/IPC при workers=1.
+
+    Запуск:
+        python -m benchmarks.bench_compute                       # 50/500/5000 задач, полный набор
+        python -m benchmarks.bench_compute --sizes 50,500 --workers 1,2,4 --output before.json
+        python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import pickle
+import random
+import time
+from typing import Callable, Dict, List
+
+from calc_scheduler import auto_chunksize
+from compute_service import (_makespan_for_order, _random_topo_order, prepare_compact_data, run_simulations,
+                             simulate_chunk)
+from routers.calculate_router import generate_random_tasks
+
+from benchmarks.common import peak_rss_mb, save_results
+
+REFERENCE_MAX_PREDS = 3
+REFERENCE_MAX_RESOURCE = 10
+
+
+def _rate(fn: Callable[[int], None], min_time: float, repeat: int = 3) -> float:
+    # удваиваем число повторов, пока замер не займёт хотя бы min_time секунд,
+    # затем берём лучший из repeat замеров — меньше шума от соседей по машине
+    n = 1
+    while True:
+        t0 = time.perf_counter()
+        fn(n)
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        n *= 2
+    best = n / elapsed
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        fn(n)
+        best = max(best, n / (time.perf_counter() - t0))
+    return best
+
+
+def bench_config(n_tasks: int, max_preds: int, max_resource: int, min_time: float) -> Dict:
+    tasks = generate_random_tasks(n_tasks, max_preds=max_preds, seed=n_tasks)
+    compact = prepare_compact_data(tasks)
+    task_nodes, task_info, preds_map = compact
+    rng = random.Random(0)
+    order = _random_topo_order(task_nodes, preds_map, rng)
+
+    def topo(n):
+        for _ in range(n):
+            _random_topo_order(task_nodes, preds_map, rng)
+
+    def makespan(n):
+        for _ in range(n):
+            _makespan_for_order(order, task_info, preds_map, max_resource)
+
+    def full(n):
+        simulate_chunk((task_nodes, task_info, preds_map, max_resource, 0, n))
+
+    chunksize = auto_chunksize(compact)
+    args = (task_nodes, task_info, preds_map, max_resource, 0, chunksize)
+    ipc_bytes = len(pickle.dumps(args)) + len(pickle.dumps(simulate_chunk(args)))
+    return {
+        "name": f"n{n_tasks}_p{max_preds}_r{max_resource}",
+        "n_tasks": n_tasks,
+        "max_preds": max_preds,
+        "max_resource": max_resource,
+        "edges": sum(len(p) for p in preds_map.values()),
+        "topo_per_sec": _rate(topo, min_time),
+        "makespan_per_sec": _rate(makespan, min_time),
+        "iterations_per_sec_per_core": _rate(full, min_time),
+        "chunksize": chunksize,
+        "ipc_bytes_per_iteration": ipc_bytes / chunksize,
+    }
+
+
+def bench_scaling(n_tasks: int, serial_rate: float, workers_list: List[int], seconds: float) -> Dict:
+    tasks = generate_random_tasks(n_tasks, max_preds=REFERENCE_MAX_PREDS, seed=n_tasks)
+    compact = prepare_compact_data(tasks)
+    chunksize = auto_chunksize(compact)
+    # столько итераций, чтобы расчёт на максимальном числе процессов шёл ~seconds
+    iterations = max(chunksize, int(serial_rate * seconds * max(workers_list)))
+    runs = []
+    for workers in workers_list:
+        result = run_simulations(None, iterations, REFERENCE_MAX_RESOURCE, workers, chunksize=chunksize,
+                                 return_best_order=False, compact=compact)
+        elapsed = result["stats"]["elapsed_seconds"]
+        throughput = iterations / elapsed
+        runs.append({
+            "name": f"w{workers}",
+            "workers": workers,
+            "elapsed_seconds": elapsed,
+            "iterations_per_sec": throughput,
+            "scaling_efficiency": throughput / (workers * serial_rate),
+        })
+    one = next((r for r in runs if r["workers"] == 1), None)
+    # при одном процессе вся разница с последовательным расчётом — запуск пула, pickle и слияние статистики
+    overhead = (1 - (iterations / serial_rate) / one["elapsed_seconds"]) if one else None
+    return {
+        "name": f"n{n_tasks}",
+        "n_tasks": n_tasks,
+        "iterations": iterations,
+        "chunksize": chunksize,
+        "pool_overhead_fraction_w1": overhead,
+        "runs": runs,
+    }
+
+
+def main(sizes: List[int], max_preds_list: List[int], max_resource_list: List[int],
+         workers_list: List[int], min_time: float, scaling_seconds: float, output: str):
+    configs = []
+    for n_tasks in sizes:
+        for max_preds in max_preds_list:
+            for max_resource in max_resource_list:
+                r = bench_config(n_tasks, max_preds, max_resource, min_time)
+                configs.append(r)
+                print(f"{r['name']:>16}: topo {r['topo_per_sec']:10.1f}/s  makespan {r['makespan_per_sec']:10.1f}/s"
+                      f"  full {r['iterations_per_sec_per_core']:10.1f}/s/core"
+                      f"  ipc {r['ipc_bytes_per_iteration']:8.1f} B/it")
+    scaling = []
+    for n_tasks in sizes:
+        reference = next((c for c in configs if c["n_tasks"] == n_tasks
+                          and c["max_preds"] == REFERENCE_MAX_PREDS and c["max_resource"] == REFERENCE_MAX_RESOURCE),
+                         None)
+        if reference is None:
+            reference = bench_config(n_tasks, REFERENCE_MAX_PREDS, REFERENCE_MAX_RESOURCE, min_time)
+        s = bench_scaling(n_tasks, reference["iterations_per_sec_per_core"], workers_list, scaling_seconds)
+        scaling.append(s)
+        runs = "  ".join(f"w{r['workers']}: {r['iterations_per_sec']:.0f}/s ({r['scaling_efficiency']:.0%})"
+                         for r in s["runs"])
+        overhead = s["pool_overhead_fraction_w1"]
+        print(f"{s['name']:>16}: {runs}" + (f"  pool overhead (w1) {overhead:.1%}" if overhead is not None else ""))
+    rss = peak_rss_mb()
+    print(f"peak RSS: self {rss['self']} MB, children {rss['children']} MB")
+    path = save_results("compute", {"configs": configs, "scaling": scaling, "peak_rss_mb": rss}, output)
+    print(f"saved: {path}")
+
+
+def _ints(value: str) -> List[int]:
+    return [int(x) for x in value.split(",") if x]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=_ints, default=[50, 500, 5000])
+    parser.add_argument("--max-preds", type=_ints, default=[1, 3, 8], help="плотность графа")
+    parser.add_argument("--max-resource", type=_ints, default=[5, 10, 20])
+    parser.add_argument("--workers", type=_ints, default=[1, 2, 4, 8])
+    parser.add_argument("--min-time", type=float, default=0.5, help="минимальная длительность одного замера, с")
+    parser.add_argument("--scaling-seconds", type=float, default=2.0)
+    parser.add_argument("--output", default=None, help="путь JSON (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+    main(args.sizes, args.max_preds, args.max_resource, args.workers, args.min_time, args.scaling_seconds,
+         args.output)
@@ -0,0 +1,119 @@
+﻿"""
+    Бенчмарк пути чтения заказа: ORM (selectinload + orm_mode) против строк с preds из array_agg.
+    Создаёт во временном заказе n задач (generate_random_tasks), читает его обоими способами,
+    сравнивает задержку и пиковый объём аллокаций (tracemalloc), затем удаляет заказ.
+
+    Запуск (нужен Postgres из DATABASE_URL, см. database.py):
+        python -m benchmarks.bench_read_path --tasks 10000 --repeat 5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+from datetime import date
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import selectinload
+
+import database
+from crud import orders_crud
+from models_db import Order, Task, task_pred_table
+from routers.calculate_router import generate_random_tasks
+from schemas import OrderModel
+
+from benchmarks.common import save_results
+
+
+async def _seed_order(n_tasks: int) -> int:
+    tasks = generate_random_tasks(n_tasks, seed=42)
+    async with database.AsyncSessionLocal() as db:
+        order_id = (await db.execute(
+            insert(Order).values(order_name=f"bench {n_tasks}", start_date=date.today()).returning(Order.id)
+        )).scalar_one()
+        ids = (await db.execute(
+            insert(Task).returning(Task.id, sort_by_parameter_order=True),
+            [{"task": f"t{t['id']}", "duration": t["duration"], "resource": t["resource"], "order_id": order_id}
+             for t in tasks]
+        )).scalars().all()
+        # локальные id 1..n -> id в БД
+        edges = [{"task_id": ids[t["id"] - 1], "pred_id": ids[p - 1]} for t in tasks for p in t["preds"]]
+        if edges:
+            await db.execute(insert(task_pred_table), edges)
+        await db.commit()
+    return order_id
+
+
+async def _drop_order(order_id: int):
+    async with database.AsyncSessionLocal() as db:
+        task_ids = select(Task.id).where(Task.order_id == order_id)
+        await db.execute(delete(task_pred_table).where(task_pred_table.c.task_id.in_(task_ids)))
+        await db.execute(delete(Task).where(Task.order_id == order_id))
+        await db.execute(delete(Order).where(Order.id == order_id))
+        await db.commit()
+
+
+async def _read_orm(order_id: int) -> dict:
+    # прежний путь: ORM-объекты Order/Task/preds_rel + валидация из атрибутов
+    async with database.AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Order).options(selectinload(Order.tasks).selectinload(Task.preds_rel)).where(Order.id == order_id)
+        )
+        order = result.scalars().first()
+        return OrderModel.model_validate(order, from_attributes=True).model_dump(mode="json")
+
+
+async def _read_rows(order_id: int) -> dict:
+    async with database.AsyncSessionLocal() as db:
+        order = await orders_crud.get_order(db, order_id)
+        return OrderModel.model_validate(order).model_dump(mode="json")
+
+
+def _normalized(order: dict) -> dict:
+    # порядок задач и preds в ORM-пути не определён — сравниваем отсортированными;
+    # order_id у вложенных задач путь строк не заполняет
+    tasks = sorted(({**t, "preds": sorted(t["preds"]), "order_id": None} for t in order["tasks"]),
+                   key=lambda t: t["id"])
+    return {**order, "tasks": tasks}
+
+
+async def _measure(read, order_id: int, repeat: int) -> dict:
+    await read(order_id)  # прогрев: соединение пула, кэш запросов
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await read(order_id)
+        times.append(time.perf_counter() - t0)
+    # аллокации меряем отдельным прогоном: tracemalloc сильно замедляет выполнение
+    tracemalloc.start()
+    await read(order_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_ms": statistics.median(times) * 1000, "min_ms": min(times) * 1000, "peak_alloc_mb": peak / 2 ** 20}
+
+
+async def main(n_tasks: int, repeat: int, output: str = None):
+    order_id = await _seed_order(n_tasks)
+    try:
+        # оба пути должны отдавать одно и то же
+        assert _normalized(await _read_orm(order_id)) == _normalized(await _read_rows(order_id))
+        print(f"order with {n_tasks} tasks, repeat={repeat}")
+        results = []
+        for name, read in (("orm", _read_orm), ("rows", _read_rows)):
+            r = await _measure(read, order_id, repeat)
+            results.append({"name": name, **r})
+            print(f"{name:>5}: median {r['median_ms']:8.1f} ms   min {r['min_ms']:8.1f} ms   "
+                  f"peak alloc {r['peak_alloc_mb']:7.1f} MB")
+        print(f"saved: {save_results('read_path', {'tasks': n_tasks, 'paths': results}, output)}")
+    finally:
+        await _drop_order(order_id)
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.tasks, args.repeat, args.output))
@@ -0,0 +1,54 @@
+﻿"""
+    Общие функции бенчмарков: окружение запуска, пиковый RSS и сохранение результатов в JSON,
+    чтобы прогоны до/после изменения можно было сравнить (python -m benchmarks.compare old.json new.json).
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    # ru_maxrss: на Linux — КБ, на macOS — байты; на Windows модуля resource нет
+    try:
+        import resource
+    except ImportError:
+        return {"self": None, "children": None}
+    scale = 1 / 2 ** 20 if sys.platform == "darwin" else 1 / 2 ** 10
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+        "timestamp": int(time.time()),
+    }
+
+
+def save_results(name: str, results: Any, output: Optional[str] = None) -> str:
+    """
+        Сохраняет {"benchmark", "env", "results"} в output или benchmarks/results/<name>_<timestamp>.json.
+    """
+    env = environment()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}_{env['timestamp']}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"benchmark": name, "env": env, "results": results}, f, ensure_ascii=False, indent=2)
+    return output
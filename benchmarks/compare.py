@@ -0,0 +1,45 @@
+﻿"""
+    Сравнение двух JSON-результатов одного бенчмарка (например, до и после изменения):
+        python -m benchmarks.compare benchmarks/results/compute_A.json benchmarks/results/compute_B.json
+    Сопоставляет числовые поля с одинаковым путём и печатает отношение new/old.
+"""
+import argparse
+import json
+from typing import Any, Dict
+
+
+def _flatten(obj: Any, prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    if isinstance(obj, dict):
+        # в списках конфигураций элементы опознаём по полю "name", а не по индексу
+        for k, v in obj.items():
+            out.update(_flatten(v, f"{prefix}.{k}" if prefix else str(k)))
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            key = v.get("name", i) if isinstance(v, dict) else i
+            out.update(_flatten(v, f"{prefix}[{key}]"))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix] = float(obj)
+    return out
+
+
+def main(old_path: str, new_path: str):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    if old.get("benchmark") != new.get("benchmark"):
+        print(f"warning: comparing different benchmarks: {old.get('benchmark')} vs {new.get('benchmark')}")
+    a, b = _flatten(old["results"]), _flatten(new["results"])
+    width = max((len(k) for k in a.keys() & b.keys()), default=10)
+    for key in sorted(a.keys() & b.keys()):
+        ratio = (b[key] / a[key]) if a[key] else float("nan")
+        print(f"{key:<{width}}  {a[key]:>14.4f}  {b[key]:>14.4f}  x{ratio:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old")
+    parser.add_argument("new")
+    args = parser.parse_args()
+    main(args.old, args.new)
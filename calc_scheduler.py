@@ -0,0 +1,386 @@
+﻿import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from concurrent.futures import BrokenExecutor, Executor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import metrics
+from compute_service import (PortfolioAccumulator, SimulationAccumulator, simulate_chunk,
+                             simulate_chunk_instrumented, simulate_chunk_sampled, simulate_portfolio_chunk,
+                             build_simulation_result, portfolio_order_stats, seed_chunks, evaluate_chunk,
+                             build_evaluation_result, order_batches, sampling_unit, align_to_unit)
+
+# общий лимит процессов на все расчёты сервера
+CALC_WORKER_SLOTS = int(os.environ.get("CALC_WORKER_SLOTS", os.cpu_count() or 1))
+# сколько расчётов одновременно делят процессы; остальные ждут в очереди
+CALC_MAX_ACTIVE_JOBS = int(os.environ.get("CALC_MAX_ACTIVE_JOBS", max(4, CALC_WORKER_SLOTS)))
+# сколько расчётов может ждать; сверх этого — отказ (429)
+CALC_MAX_QUEUED_JOBS = int(os.environ.get("CALC_MAX_QUEUED_JOBS", 16))
+# целевой объём работы одной порции в "вершинах+дугах": порция должна считаться доли секунды,
+# чтобы процессы быстро переходили между расчётами (round-robin), но не дробить IPC зря
+CALC_CHUNK_WORK = int(os.environ.get("CALC_CHUNK_WORK", 200_000))
+CALC_MAX_CHUNK = 4096
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+def auto_chunksize(compact) -> int:
+    task_nodes, _, preds_map = compact
+    size = len(task_nodes) + sum(len(p) for p in preds_map.values())
+    return max(1, min(CALC_MAX_CHUNK, CALC_CHUNK_WORK // max(1, size)))
+
+
+class _Job(ABC):
+    """
+        Общая часть задания планировщика: порции (idx, start, count), квота процессов,
+        future для ожидающего запроса и отметки времени. Подкласс решает, что считать
+        в процессе (chunk_call) и как принять результат порции (add_result).
+    """
+
+    def __init__(self, batches: List[Tuple[int, int]], parallel: int):
+        self.parallel = parallel
+        self.chunks: Deque[Tuple[int, int, int]] = deque(
+            (idx, start, count) for idx, (start, count) in enumerate(batches)
+        )
+        self.n_chunks = len(self.chunks)
+        self.in_flight = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def wait_seconds(self) -> float:
+        return (self.started_at or time.monotonic()) - self.submitted_at
+
+    @abstractmethod
+    def chunk_call(self, start: int, count: int) -> Tuple[Callable, tuple]:
+        """Функция и аргументы порции [start, start + count) для процесса пула."""
+
+    @abstractmethod
+    def add_result(self, idx: int, chunk, round_trip: float) -> bool:
+        """Принять результат порции; True — задание досчитано."""
+
+
+class CalcJob(_Job):
+    """
+        Один расчёт: граф, порции seeds и накопленная статистика.
+        Порции могут завершаться в любом порядке, но в SimulationAccumulator
+        добавляются строго по порядку — результат совпадает с run_simulations.
+    """
+
+    def __init__(self, compact, iterations: int, max_resource: int, parallel: int,
+                 seed_base: int, sample_size: int, chunksize: int,
+                 instrumented: bool = False, profile_interval: Optional[float] = None,
+                 portfolio: Optional[Tuple[List[List[int]], List[float]]] = None,
+                 sampling: str = "uniform"):
+        # схема выборки: порции состоят из целых блоков (пар / наборов по корням), см. sampling_unit
+        self.unit = sampling_unit(compact[0], compact[2], sampling)
+        iterations, chunksize = align_to_unit(iterations, chunksize, self.unit)
+        super().__init__(seed_chunks(iterations, seed_base, chunksize), parallel)
+        self.compact = compact
+        self.iterations = iterations
+        self.max_resource = max_resource
+        self.sampling = sampling
+        self.next_merge = 0
+        self.pending: Dict[int, tuple] = {}
+        # портфель (groups, offsets из merge_portfolio) — порции считают ещё и makespan по заказам
+        self.portfolio = portfolio
+        if portfolio is None:
+            self.acc = SimulationAccumulator(sample_size, seed_base, sampling)
+        else:
+            self.acc = PortfolioAccumulator(len(portfolio[0]), sample_size, seed_base)
+        # замеры этапов (metrics.StageTimings) и профиль порций — только по запросу,
+        # не для портфеля и только для uniform
+        instrumented = portfolio is None and sampling == "uniform" and (
+            instrumented or profile_interval is not None)
+        self.timings = metrics.StageTimings() if instrumented else None
+        self.profile_interval = profile_interval if instrumented else None
+        self.stacks: Counter = Counter()
+
+    def chunk_call(self, start: int, count: int) -> Tuple[Callable, tuple]:
+        task_nodes, task_info, preds_map = self.compact
+        args = (task_nodes, task_info, preds_map, self.max_resource, start, count)
+        if self.portfolio is not None:
+            return simulate_portfolio_chunk, (args + self.portfolio,)
+        if self.sampling != "uniform":
+            return simulate_chunk_sampled, (args + (self.sampling, self.unit),)
+        if self.timings is None:
+            return simulate_chunk, (args,)
+        return simulate_chunk_instrumented, (args, self.profile_interval)
+
+    def add_result(self, idx: int, chunk, round_trip: float) -> bool:
+        if self.timings is not None:
+            makespans, best_makespan, best_order, timing, stacks = chunk
+            self.timings.add_chunk(timing, round_trip)
+            if stacks:
+                self.stacks.update(stacks)
+            chunk = makespans, best_makespan, best_order
+        self.pending[idx] = chunk
+        metrics.CALC_SIMULATIONS.inc(len(chunk[0]))
+        # сливаем готовые порции строго по порядку seeds
+        t0 = time.perf_counter()
+        while self.next_merge in self.pending:
+            self.acc.add_chunk(*self.pending.pop(self.next_merge))
+            self.next_merge += 1
+        if self.timings is not None:
+            self.timings.add("aggregate", time.perf_counter() - t0)
+        return self.next_merge == self.n_chunks
+
+
+class EvalJob(_Job):
+    """
+        Оценка заданных порядков: порции — отрезки плоского массива orders,
+        результаты порций просто складываются по номерам (порядок слияния не важен).
+    """
+
+    def __init__(self, compact, orders: List[int], max_resource: int, parallel: int, chunksize: int,
+                 with_schedules: bool):
+        self.n_tasks = len(compact[0])
+        super().__init__(order_batches(orders, self.n_tasks, chunksize), parallel)
+        self.compact = compact
+        self.orders = orders
+        self.max_resource = max_resource
+        self.with_schedules = with_schedules
+        self.results: List[Optional[tuple]] = [None] * self.n_chunks
+        self.done_chunks = 0
+
+    def chunk_call(self, start: int, count: int) -> Tuple[Callable, tuple]:
+        _, task_info, preds_map = self.compact
+        n = self.n_tasks
+        orders = self.orders[start * n:(start + count) * n]
+        return evaluate_chunk, ((task_info, preds_map, self.max_resource, orders, n, self.with_schedules),)
+
+    def add_result(self, idx: int, chunk, round_trip: float) -> bool:
+        self.results[idx] = chunk
+        self.done_chunks += 1
+        metrics.CALC_EVALUATED_ORDERS.inc(len(chunk[0]))
+        return self.done_chunks == self.n_chunks
+
+
+class CalcScheduler:
+    """
+        Планировщик расчётов между роутером и compute_service:
+        - один общий ProcessPoolExecutor на slots процессов вместо пула на каждый запрос;
+        - не больше max_active расчётов одновременно, до max_queued ждут в очереди, остальным — SchedulerBusy;
+        - свободный процесс получает порцию следующего по кругу (round-robin) расчёта,
+          так что одновременные расчёты делят ядра поровну, а не по очереди целиком.
+        Расчёт — случайный поиск (run) или оценка заданных порядков (evaluate).
+        Все методы вызываются из event loop (без блокировок).
+    """
+
+    def __init__(self, slots: int = CALC_WORKER_SLOTS, max_active: int = CALC_MAX_ACTIVE_JOBS,
+                 max_queued: int = CALC_MAX_QUEUED_JOBS):
+        self.slots = max(1, slots)
+        self.max_active = max(1, max_active)
+        self.max_queued = max(0, max_queued)
+        self._pool: Optional[Executor] = None
+        self._active: List[_Job] = []
+        self._waiting: Deque[_Job] = deque()
+        self._rr = 0
+        self._in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._started = 0
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            # multiprocessing подгружается при первом расчёте, а не при старте сервера
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.slots)
+        return self._pool
+
+    def _check_capacity(self):
+        if len(self._active) >= self.max_active and len(self._waiting) >= self.max_queued:
+            self.rejected += 1
+            raise SchedulerBusy(f"calculation queue is full ({len(self._waiting)} waiting)")
+
+    def _parallel(self, workers: Optional[int]) -> int:
+        # роутеры ограничивают workers диапазоном 1..slots; здесь — на случай прямого вызова
+        return max(1, min(self.slots, workers or self.slots))
+
+    async def _submit(self, job: _Job):
+        # ставим задание в очередь и ждём, пока все его порции будут посчитаны
+        self.submitted += 1
+        self._waiting.append(job)
+        self._admit()
+        self._dispatch()
+        try:
+            await job.future
+        finally:
+            # запрос отменён (клиент ушёл) — оставшиеся порции больше не раздаём
+            if not job.future.done():
+                job.future.cancel()
+            self._drop(job)
+        metrics.CALC_JOB_SECONDS.observe(time.monotonic() - job.started_at)
+
+    async def run(self, compact, iterations: int, max_resource: int,
+                  workers: Optional[int] = None,
+                  seed_base: int = 0,
+                  sample_size: int = 10000,
+                  chunksize: Optional[int] = None,
+                  return_best_order: bool = True,
+                  log_dir: Optional[str] = None,
+                  log_time_unit: Optional[float] = None,
+                  profile_interval: Optional[float] = None,
+                  portfolio: Optional[Tuple[List[List[int]], List[float]]] = None,
+                  sampling: str = "uniform") -> Dict[str, Any]:
+        """
+            Аналог run_simulations для сервера. workers — сколько процессов из общего пула
+            расчёт может занимать одновременно (не больше slots).
+            profile_interval — снять сэмплирующий профиль порций этого расчёта (в результат
+            попадают "profile" и "timings"); поэтапные замеры без профиля — при CALC_STAGE_TIMINGS=1.
+            portfolio — (groups, offsets) для графа из merge_portfolio: в результат добавляется
+            "orders" — статистика makespan по каждому заказу.
+            sampling — схема выборки порядков (compute_service.sampling_unit); для портфеля — только uniform.
+        """
+        if iterations <= 0:
+            raise ValueError("iterations must be > 0")
+        if portfolio is not None and sampling != "uniform":
+            raise ValueError("portfolio supports only uniform sampling")
+        self._check_capacity()
+        parallel = self._parallel(workers)
+        job = CalcJob(compact, iterations, max_resource, parallel, seed_base, sample_size,
+                      chunksize or auto_chunksize(compact), metrics.CALC_STAGE_TIMINGS, profile_interval,
+                      portfolio, sampling)
+        await self._submit(job)
+        elapsed = job.finished_at - job.started_at
+        result = await asyncio.to_thread(
+            build_simulation_result, job.acc, compact, job.iterations, max_resource, parallel, elapsed,
+            return_best_order, log_dir, log_time_unit, job.timings
+        )
+        result["queue_wait_seconds"] = job.wait_seconds
+        if portfolio is not None:
+            result["orders"] = portfolio_order_stats(job.acc, compact, max_resource, *portfolio)
+        if job.timings is not None:
+            job.timings.record()
+            result["timings"] = job.timings.summary()
+        if job.profile_interval is not None:
+            from profiling import summarize
+            result["profile"] = summarize(job.stacks, job.profile_interval)
+        return result
+
+    async def evaluate(self, compact, orders: List[int], max_resource: int,
+                       workers: Optional[int] = None,
+                       chunksize: Optional[int] = None,
+                       with_schedules: bool = False) -> Dict[str, Any]:
+        """
+            Аналог compute_service.evaluate_orders для сервера: порции заданных порядков
+            считаются в общем пуле наравне с другими расчётами.
+            ValueError — если длина orders не кратна числу задач графа.
+        """
+        job = EvalJob(compact, orders, max_resource, self._parallel(workers),
+                      chunksize or auto_chunksize(compact), with_schedules)
+        self._check_capacity()
+        await self._submit(job)
+        result = await asyncio.to_thread(
+            build_evaluation_result, job.results, max_resource, job.parallel, job.finished_at - job.started_at,
+            with_schedules
+        )
+        result["queue_wait_seconds"] = job.wait_seconds
+        return result
+
+    def _admit(self):
+        while self._waiting and len(self._active) < self.max_active:
+            job = self._waiting.popleft()
+            if not job.future.done():
+                self._active.append(job)
+
+    def _drop(self, job: _Job):
+        if job in self._active:
+            self._active.remove(job)
+        elif job in self._waiting:
+            self._waiting.remove(job)
+        job.chunks.clear()
+
+    def _next_job(self) -> Optional[_Job]:
+        # round-robin по активным расчётам, у которых есть порции и свободная квота процессов
+        n = len(self._active)
+        for k in range(n):
+            job = self._active[(self._rr + k) % n]
+            if job.chunks and job.in_flight < job.parallel and not job.future.done():
+                self._rr = (self._rr + k + 1) % n
+                return job
+        return None
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._in_flight < self.slots:
+            job = self._next_job()
+            if job is None:
+                return
+            idx, start, count = job.chunks.popleft()
+            if job.started_at is None:
+                job.started_at = time.monotonic()
+                self._started += 1
+                self._wait_total += job.wait_seconds
+                self._wait_max = max(self._wait_max, job.wait_seconds)
+                metrics.CALC_QUEUE_WAIT_SECONDS.observe(job.wait_seconds)
+            fn, args = job.chunk_call(start, count)
+            try:
+                fut = loop.run_in_executor(self._get_pool(), fn, *args)
+            except BrokenExecutor as e:
+                self._pool = None
+                self._fail(job, e)
+                continue
+            self._in_flight += 1
+            job.in_flight += 1
+            fut.add_done_callback(lambda f, job=job, idx=idx, t=time.perf_counter():
+                                  self._on_chunk_done(job, idx, f, t))
+
+    def _on_chunk_done(self, job: _Job, idx: int, fut: asyncio.Future, submitted_at: float):
+        self._in_flight -= 1
+        job.in_flight -= 1
+        if fut.cancelled() or job.future.done():
+            pass
+        elif fut.exception() is not None:
+            if isinstance(fut.exception(), BrokenExecutor):
+                self._pool = None
+            self._fail(job, fut.exception())
+        else:
+            metrics.CALC_CHUNKS.inc()
+            if job.add_result(idx, fut.result(), time.perf_counter() - submitted_at):
+                job.finished_at = time.monotonic()
+                self.completed += 1
+                self._drop(job)
+                job.future.set_result(None)
+        self._admit()
+        self._dispatch()
+
+    def _fail(self, job: _Job, exc: BaseException):
+        self.failed += 1
+        self._drop(job)
+        if not job.future.done():
+            job.future.set_exception(exc)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.slots,
+            "busy_slots": self._in_flight,
+            "active_jobs": len(self._active),
+            "queue_depth": len(self._waiting),
+            "max_active_jobs": self.max_active,
+            "max_queued_jobs": self.max_queued,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": (self._wait_total / self._started) if self._started else None,
+            "max_wait_seconds": self._wait_max,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+scheduler = CalcScheduler()
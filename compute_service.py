@@ -1,14 +1,23 @@
-﻿import random
-import heapq
+﻿import os
+import random
 import math
 import time
 import json
 
-from typing import List, Dict, Tuple, Optional, Any
-from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Tuple, Optional, Any, Literal
+
+import metrics
 
 MAX_RESOURCE_DEFAULT = 10
 
+# схема выборки порядков в run_simulations: uniform — независимые случайные порядки,
+# antithetic — пары "зеркальных" порядков, stratified — расслоение по первой задаче порядка
+Sampling = Literal["uniform", "antithetic", "stratified"]
+SAMPLING_SCHEMES = ("uniform", "antithetic", "stratified")
+# stratified: не больше стольких слоёв (блок — столько же порядков), сколько бы ни было корней
+SAMPLING_MAX_STRATA = int(os.environ.get("SAMPLING_MAX_STRATA", 16))
+
 
 def prepare_compact_data(tasks: List[dict]):
     """
@@ -62,25 +71,97 @@ def _random_topo_order(nodes: List[int], preds_map: Dict[int, List[int]], rng: r
     return order
 
 
+class _ResourceProfile:
+    """
+        Занятый ресурс как ступенчатая функция времени: usage[k] действует на [times[k], times[k+1]).
+        Прямой проход (_makespan_for_order) ищет по нему самый ранний старт, обратный (cpm.resource_slack) —
+        самый поздний. Задача с resource > max_resource может идти только одна, задачи с нулевым ресурсом
+        ограничение не проверяют.
+    """
+
+    def __init__(self):
+        self.times: List[float] = [float("-inf")]
+        self.usage: List[int] = [0]
+
+    def _split(self, t: float) -> int:
+        k = bisect_right(self.times, t) - 1
+        if self.times[k] != t:
+            k += 1
+            self.times.insert(k, t)
+            self.usage.insert(k, self.usage[k - 1])
+        return k
+
+    def add(self, start: float, end: float, resource: int):
+        if end <= start or resource == 0:
+            return
+        i = self._split(start)
+        j = self._split(end)
+        for k in range(i, j):
+            self.usage[k] += resource
+
+    @staticmethod
+    def _fits(used: int, resource: int, max_resource: int) -> bool:
+        return used == 0 or used + resource <= max_resource
+
+    def earliest_start(self, earliest: float, duration: float, resource: int, max_resource: int) -> float:
+        """Самый ранний старт t >= earliest, при котором [t, t + duration) помещается по ресурсу."""
+        if duration <= 0 or resource == 0:
+            return earliest
+        times, usage = self.times, self.usage
+        start = earliest
+        k = bisect_right(times, start) - 1  # участок, в котором лежит start
+        while True:
+            end = start + duration
+            j = k
+            while j < len(times) and times[j] < end:
+                if not self._fits(usage[j], resource, max_resource):
+                    break
+                j += 1
+            else:
+                return start
+            # на участке j не помещается — окно начнётся не раньше его конца (последний участок всегда свободен)
+            k = j + 1
+            start = times[k]
+
+    def latest_start(self, earliest: float, latest: float, duration: float, resource: int,
+                     max_resource: int) -> float:
+        """
+            Самый поздний старт t в [earliest, latest], при котором [t, t + duration) помещается по ресурсу;
+            если такого нет — earliest.
+        """
+        if duration <= 0 or resource == 0:
+            return latest
+        end = latest + duration
+        k = bisect_left(self.times, end) - 1  # участок, в котором лежит end - 0
+        while end - duration > earliest:
+            if not self._fits(self.usage[k], resource, max_resource):
+                # окно должно закончиться не позже начала участка, где задача не помещается
+                end = self.times[k]
+            elif self.times[k] <= end - duration:
+                return end - duration
+            k -= 1
+        return earliest
+
+
 def _makespan_for_order(order: List[int], task_info: Dict[int, Tuple[float, int]], preds_map: Dict[int, List[int]],
-                        max_resource: int) -> float:
+                        max_resource: int, scheduled_end: Optional[Dict[int, float]] = None) -> float:
     """
-        Симуляция выполнения задач в заданном порядке при ограничении суммарного ресурса:
-        - running: min-heap событий (end_time, task_id, resource) — отслеживаем активные задачи
-        - resource_in_use: сколько ресурса занято в текущий момент
-        - finish_times: время завершения каждой задачи (чтобы учитывать предшественников)
+        Симуляция выполнения задач в заданном порядке при ограничении суммарного ресурса
+        (последовательная схема построения расписания):
+        - profile: занятый ресурс по времени (_ResourceProfile) от уже запланированных задач
+        - scheduled_end: время завершения каждой задачи (чтобы учитывать предшественников)
         Алгоритм для каждой задачи tid в order:
-          1) earliest = max(finish_times[pred] for pred in preds) — задача не может стартовать до завершения предов
-          2) освобождаем завершившиеся к моменту earliest задачи (pop из heap)
-          3) если после этого нет свободного ресурса (resource_in_use + res > max_resource),
-             извлекаем следующее ближайшее событие (передвигаем текущий момент на end_time), освобождаем ресурс,
-             повторяем до тех пор, пока хватит ресурса
-          4) стартуем задачу: start = t, end = start + dur, пушим событие в heap и увеличиваем resource_in_use
-        Возвращаем makespan = максимальное время завершения.
-    """
-    running = []  # heap of (end_time, task_id, resource)
-    resource_in_use = 0
-    scheduled_end: Dict[int, float] = {}
+          1) earliest = max(scheduled_end[pred] for pred in preds) — задача не может стартовать до завершения предов
+          2) start — самый ранний момент >= earliest, когда на всём [start, start + dur) хватает ресурса
+             вместе с уже запланированными задачами (в том числе в "окна" до старта предыдущих по order задач)
+          3) end = start + dur, занимаем ресурс на [start, end) в profile
+        Суммарный ресурс ни в какой момент не превышает max_resource (кроме задачи с resource > max_resource —
+        она идёт одна). Возвращаем makespan = максимальное время завершения.
+        scheduled_end — если передан пустой dict, в нём останутся окончания всех задач (для портфеля).
+    """
+    profile = _ResourceProfile()
+    if scheduled_end is None:
+        scheduled_end = {}
     makespan = 0.0
 
     for tid in order:
@@ -92,27 +173,12 @@ def _makespan_for_order(order: List[int], task_info: Dict[int, Tuple[float, int]
             raise RuntimeError(f"Invalid order: predecessors {missing} for task {tid} are not scheduled before it")
         # earliest — по запланированным окончаниям предков
         earliest = max((scheduled_end.get(p, 0.0) for p in preds), default=0.0)
-        t = earliest
-        # освобождаем завершившиеся до или в t
-        while running and running[0][0] <= t:
-            end_time, _, ended_res = heapq.heappop(running)
-            resource_in_use -= ended_res
-        # если не хватает ресурса — ждем ближайшего завершения(ий)
-        while resource_in_use + res > max_resource and running:
-            end_time, _, ended_res = heapq.heappop(running)
-            if end_time > t:
-                t = end_time
-            resource_in_use -= ended_res
-            while running and running[0][0] <= t:
-                et2, _, er2 = heapq.heappop(running)
-                resource_in_use -= er2
         # стартуем задачу и сохраняем запланированное окончание
-        start = t
+        start = profile.earliest_start(earliest, dur, res, max_resource)
         end = start + dur
         scheduled_end[tid] = end
         makespan = max(makespan, end)
-        heapq.heappush(running, (end, tid, res))
-        resource_in_use += res
+        profile.add(start, end, res)
 
     return makespan
 
@@ -130,106 +196,535 @@ def _single_simulation_return_order(task_nodes, task_info, preds_map, max_resour
     return makespan, order
 
 
-def _worker_tuple(args):
-    # адаптер для ProcessPoolExecutor.map — unpack аргументов
-    seed, task_nodes, task_info, preds_map, max_resource = args
-    return _single_simulation_return_order(task_nodes, task_info, preds_map, max_resource, seed)
+def simulate_chunk(args, timing: Optional[dict] = None):
+    """
+       Порция симуляций в одном процессе: seeds [seed_start, seed_start + count).
+       Граф передаётся один раз на порцию, а обратно идут только makespan'ы и лучший порядок порции —
+       вместо (makespan, order) на каждую симуляцию. Это резко уменьшает IPC.
+       timing — словарь с "topo_order" и "makespan": если передан, сюда добавляется время генерации
+       порядков и расчёта makespan по отдельности (для metrics, без него засечек нет).
+       Возвращаем (makespans, best_makespan, best_order); лучший — первый минимальный в порядке seeds.
+    """
+    task_nodes, task_info, preds_map, max_resource, seed_start, count = args
+    clock = time.perf_counter
+    makespans = []
+    best_makespan = float("inf")
+    best_order = None
+    for seed in range(seed_start, seed_start + count):
+        if timing is None:
+            makespan, order = _single_simulation_return_order(task_nodes, task_info, preds_map, max_resource, seed)
+        else:
+            t0 = clock()
+            order = _random_topo_order(task_nodes, preds_map, random.Random(seed))
+            t1 = clock()
+            makespan = _makespan_for_order(order, task_info, preds_map, max_resource)
+            timing["topo_order"] += t1 - t0
+            timing["makespan"] += clock() - t1
+        makespans.append(makespan)
+        if makespan < best_makespan:
+            best_makespan = makespan
+            best_order = order
+    return makespans, best_makespan, best_order
+
+
+def simulate_chunk_instrumented(args, profile_interval: Optional[float] = None):
+    """
+       simulate_chunk с замерами для metrics: время генерации порядков и расчёта makespan
+       по отдельности, pid процесса и время порции целиком. Результаты те же, что у simulate_chunk.
+       profile_interval — дополнительно снять сэмплирующий профиль порции (profiling.StackSampler).
+       Возвращаем (makespans, best_makespan, best_order, timing, stacks или None).
+    """
+    timing = {"pid": os.getpid(), "count": args[-1], "topo_order": 0.0, "makespan": 0.0}
+    chunk_start = time.perf_counter()
+    stacks = None
+    if profile_interval is not None:
+        from profiling import StackSampler
+        with StackSampler(profile_interval) as sampler:
+            makespans, best_makespan, best_order = simulate_chunk(args, timing)
+        stacks = dict(sampler.stacks)
+    else:
+        makespans, best_makespan, best_order = simulate_chunk(args, timing)
+    timing["wall"] = time.perf_counter() - chunk_start
+    return makespans, best_makespan, best_order, timing, stacks
+
+
+def _uniform_topo_order(nodes: List[int], preds_map: Dict[int, List[int]], rng: random.Random,
+                        stratum: Optional[Tuple[int, int]] = None, mirror: bool = False) -> List[int]:
+    """
+       Как _random_topo_order, но каждый выбор задаётся равномерным u = rng.random():
+       берём available[int(u * len(available))]. Это позволяет:
+       - mirror — взять 1 - u на каждом шаге (антитетический порядок к порядку с тем же rng);
+       - stratum = (j, m) — для первого выбора взять u из j-го из m равных интервалов [j/m, (j+1)/m)
+         (расслоение по первой задаче).
+    """
+    indeg = {n: 0 for n in nodes}
+    out = {n: [] for n in nodes}
+    for t, preds in preds_map.items():
+        for p in preds:
+            out.setdefault(p, []).append(t)
+            indeg[t] = indeg.get(t, 0) + 1
+    available = [n for n, d in indeg.items() if d == 0]
+    order = []
+    while available:
+        u = rng.random()
+        if stratum is not None:
+            u = (stratum[0] + u) / stratum[1]
+            stratum = None
+        elif mirror:
+            u = 1.0 - u
+        idx = min(len(available) - 1, int(u * len(available)))
+        node = available.pop(idx)
+        order.append(node)
+        for nbr in out.get(node, ()):
+            indeg[nbr] -= 1
+            if indeg[nbr] == 0:
+                available.append(nbr)
+    if len(order) != len(nodes):
+        remaining = [n for n in nodes if n not in order]
+        rng.shuffle(remaining)
+        order.extend(remaining)
+    return order
 
 
-def run_simulations(tasks: List[dict],
-                    iterations: int = 1_000_000,
+def sampling_unit(task_nodes: List[int], preds_map: Dict[int, List[int]], sampling: str) -> int:
+    """
+        Размер блока схемы выборки: столько симуляций подряд (по seeds) образуют одну независимую
+        реплику, и стандартная ошибка считается по разбросу средних блоков.
+        uniform — 1; antithetic — 2 (порядок и зеркальный к нему);
+        stratified — m = min(число корней, SAMPLING_MAX_STRATA): случайное число первого выбора
+        делится на m равных интервалов, в блоке по порядку на интервал. Каждый интервал имеет
+        вероятность 1/m, так что среднее блока — несмещённая оценка при любом числе корней,
+        а при m = числу корней каждый порядок блока начинается со своего корня.
+    """
+    if sampling not in SAMPLING_SCHEMES:
+        raise ValueError(f"unknown sampling {sampling!r}, expected one of {SAMPLING_SCHEMES}")
+    if sampling == "antithetic":
+        return 2
+    if sampling == "stratified":
+        roots = sum(1 for tid in task_nodes if not preds_map.get(tid))
+        return max(1, min(roots, SAMPLING_MAX_STRATA))
+    return 1
+
+
+def align_to_unit(iterations: int, chunksize: int, unit: int) -> Tuple[int, int]:
+    # блок не делится между порциями: iterations и chunksize округляем до кратных unit (iterations — вверх)
+    return -(-iterations // unit) * unit, unit * max(1, chunksize // unit)
+
+
+def simulate_chunk_sampled(args):
+    """
+       Порция симуляций со схемой выборки antithetic или stratified (см. sampling_unit).
+       Порция состоит из целых блоков по unit seeds, начиная с seed_start:
+       - antithetic: оба порядка пары строятся от rng блока, второй — зеркальный;
+       - stratified: первый выбор j-го порядка блока — из j-го слоя, дальше — выбор от своего seed.
+       Возвращаем (makespans, best_makespan, best_order, моменты средних по блокам).
+    """
+    task_nodes, task_info, preds_map, max_resource, seed_start, count, sampling, unit = args
+    makespans = []
+    unit_means = []
+    best_makespan = float("inf")
+    best_order = None
+    for unit_start in range(seed_start, seed_start + count, unit):
+        total = 0.0
+        for j in range(unit):
+            if sampling == "antithetic":
+                order = _uniform_topo_order(task_nodes, preds_map, random.Random(unit_start), mirror=j == 1)
+            else:
+                order = _uniform_topo_order(task_nodes, preds_map, random.Random(unit_start + j),
+                                            stratum=(j, unit))
+            makespan = _makespan_for_order(order, task_info, preds_map, max_resource)
+            makespans.append(makespan)
+            total += makespan
+            if makespan < best_makespan:
+                best_makespan = makespan
+                best_order = order
+        unit_means.append(total / unit)
+    return makespans, best_makespan, best_order, _moments(unit_means)
+
+
+def merge_portfolio(graphs: List[Tuple[List[int], Dict, Dict]], offsets: List[float]):
+    """
+        Объединяет компактные графы нескольких заказов в один граф портфеля за O(V+E):
+        - задачи и связи просто сливаются (id задач уникальны между заказами);
+        - заказу со сдвигом offset > 0 (позже начинается) добавляется псевдозадача "старт заказа"
+          с id -(k+1), длительностью offset и ресурсом 0, она становится предшественником
+          корневых задач заказа — так задачи заказа не стартуют раньше его даты.
+        Списки preds исходных графов не меняются (они могут лежать в graph_cache).
+        Возвращаем (compact, groups): groups[k] — id задач k-го заказа.
+    """
+    task_nodes: List[int] = []
+    task_info: Dict[int, Tuple[float, int]] = {}
+    preds_map: Dict[int, List[int]] = {}
+    groups: List[List[int]] = []
+    for k, ((nodes, info, preds), offset) in enumerate(zip(graphs, offsets)):
+        groups.append(nodes)
+        task_nodes.extend(nodes)
+        task_info.update(info)
+        preds_map.update(preds)
+        if offset > 0:
+            release = -(k + 1)
+            task_nodes.append(release)
+            task_info[release] = (offset, 0)
+            preds_map[release] = []
+            for tid in nodes:
+                if not preds[tid]:
+                    preds_map[tid] = [release]
+    return (task_nodes, task_info, preds_map), groups
+
+
+def portfolio_makespans(scheduled_end: Dict[int, float], groups: List[List[int]],
+                        offsets: List[float]) -> List[float]:
+    # makespan каждого заказа портфеля — от его даты старта до окончания последней задачи
+    return [max(scheduled_end[tid] for tid in nodes) - offset for nodes, offset in zip(groups, offsets)]
+
+
+def simulate_portfolio_chunk(args):
+    """
+       Порция симуляций портфеля (граф из merge_portfolio): как simulate_chunk, плюс makespan'ы
+       каждого заказа. Наружу уходят не значения, а моменты по заказам (n, mean, m2, min, max) —
+       IPC не растёт с числом итераций. Возвращаем (makespans, best_makespan, best_order, order_moments).
+    """
+    task_nodes, task_info, preds_map, max_resource, seed_start, count, groups, offsets = args
+    makespans = []
+    per_order: List[List[float]] = [[] for _ in groups]
+    best_makespan = float("inf")
+    best_order = None
+    for seed in range(seed_start, seed_start + count):
+        rng = random.Random(seed)
+        order = _random_topo_order(task_nodes, preds_map, rng)
+        ends: Dict[int, float] = {}
+        makespan = _makespan_for_order(order, task_info, preds_map, max_resource, ends)
+        for values, value in zip(per_order, portfolio_makespans(ends, groups, offsets)):
+            values.append(value)
+        makespans.append(makespan)
+        if makespan < best_makespan:
+            best_makespan = makespan
+            best_order = order
+    return makespans, best_makespan, best_order, [_moments(values) for values in per_order]
+
+
+def _moments(values: List[float]) -> Tuple[int, float, float, float, float]:
+    n = len(values)
+    mean = sum(values) / n
+    return n, mean, sum((v - mean) ** 2 for v in values), min(values), max(values)
+
+
+_NO_MOMENTS = (0, 0.0, 0.0, float("inf"), float("-inf"))
+
+
+def _merge_moments(a: Tuple[int, float, float, float, float],
+                   b: Tuple[int, float, float, float, float]) -> Tuple[int, float, float, float, float]:
+    # слияние (n, mean, m2, min, max) двух частей формулой Чана (параллельный Вельфорд)
+    na, ma, m2a, mina, maxa = a
+    nb, mb, m2b, minb, maxb = b
+    n = na + nb
+    if n == 0:
+        return a
+    delta = mb - ma
+    return n, ma + delta * nb / n, m2a + m2b + delta * delta * na * nb / n, min(mina, minb), max(maxa, maxb)
+
+
+def validate_order(order: List[int], task_info: Dict[int, Tuple[float, int]],
+                   preds_map: Dict[int, List[int]]) -> Optional[str]:
+    """
+        Проверка заданного порядка за O(V+E): каждая задача графа ровно один раз
+        и каждый предшественник стоит раньше задачи. Возвращаем текст ошибки или None.
+    """
+    if len(order) != len(task_info):
+        return f"expected {len(task_info)} tasks, got {len(order)}"
+    pos: Dict[int, int] = {}
+    for i, tid in enumerate(order):
+        if tid not in task_info:
+            return f"unknown task {tid} at position {i}"
+        if tid in pos:
+            return f"task {tid} repeated at position {i}"
+        pos[tid] = i
+    for i, tid in enumerate(order):
+        for p in preds_map.get(tid, ()):
+            if p not in pos:
+                return f"predecessor {p} of task {tid} is not a task of this order"
+            if pos[p] > i:
+                return f"task {tid} at position {i} comes before its predecessor {p}"
+    return None
+
+
+def evaluate_chunk(args):
+    """
+       Оценка порции заданных порядков в одном процессе (без случайной генерации).
+       orders — плоский массив: порядки по n_tasks id подряд. Каждый порядок один раз проверяется
+       validate_order, корректные считаются _makespan_for_order.
+       Возвращаем (makespans, errors, schedules): makespan или None для некорректного порядка,
+       errors — [(номер порядка в порции, текст)], schedules — времена стартов по позициям порядка
+       (только если with_schedules, иначе None).
+    """
+    task_info, preds_map, max_resource, orders, n_tasks, with_schedules = args
+    makespans: List[Optional[float]] = []
+    errors: List[Tuple[int, str]] = []
+    schedules: Optional[List[Optional[List[float]]]] = [] if with_schedules else None
+    for k, i in enumerate(range(0, len(orders), n_tasks)):
+        order = orders[i:i + n_tasks]
+        error = validate_order(order, task_info, preds_map)
+        if error is not None:
+            makespans.append(None)
+            errors.append((k, error))
+            if schedules is not None:
+                schedules.append(None)
+        elif schedules is None:
+            makespans.append(_makespan_for_order(order, task_info, preds_map, max_resource))
+        else:
+            ends: Dict[int, float] = {}
+            makespans.append(_makespan_for_order(order, task_info, preds_map, max_resource, ends))
+            schedules.append([ends[tid] - task_info[tid][0] for tid in order])
+    return makespans, errors, schedules
+
+
+def build_evaluation_result(chunks: List[tuple], max_resource: int, workers: int, elapsed: float,
+                            with_schedules: bool = False) -> Dict[str, Any]:
+    """
+        Итог оценки заданных порядков из результатов evaluate_chunk (в порядке порций):
+        makespan'ы по порядкам, ошибки проверки, лучший порядок и сводная статистика.
+    """
+    makespans: List[Optional[float]] = []
+    errors: List[Dict[str, Any]] = []
+    schedules: List[Optional[List[float]]] = []
+    for chunk_makespans, chunk_errors, chunk_schedules in chunks:
+        base = len(makespans)
+        errors.extend({"index": base + k, "error": error} for k, error in chunk_errors)
+        makespans.extend(chunk_makespans)
+        if chunk_schedules is not None:
+            schedules.extend(chunk_schedules)
+    valid = [m for m in makespans if m is not None]
+    best = None
+    if valid:
+        best_makespan = min(valid)
+        best = {"index": makespans.index(best_makespan), "makespan": best_makespan}
+    result = {
+        "count": len(makespans),
+        "valid": len(valid),
+        "max_resource": max_resource,
+        "workers": workers,
+        "stats": {
+            "avg": (sum(valid) / len(valid)) if valid else None,
+            "min": min(valid) if valid else None,
+            "max": max(valid) if valid else None,
+            "elapsed_seconds": elapsed,
+        },
+        "best": best,
+        "makespans": makespans,
+        "errors": errors,
+    }
+    if with_schedules:
+        result["schedules"] = schedules
+    return result
+
+
+def order_batches(orders: List[int], n_tasks: int, chunksize: int) -> List[Tuple[int, int]]:
+    # разбиение плоского массива порядков на порции (первый порядок, число порядков)
+    if n_tasks <= 0 or len(orders) % n_tasks:
+        raise ValueError(f"orders length {len(orders)} is not a multiple of the number of tasks ({n_tasks})")
+    return seed_chunks(len(orders) // n_tasks, 0, chunksize)
+
+
+def evaluate_orders(compact: Tuple[List[int], Dict, Dict],
+                    orders: List[int],
                     max_resource: int = MAX_RESOURCE_DEFAULT,
                     workers: Optional[int] = None,
-                    seed_base: int = 0,
-                    sample_size: int = 10000,
                     chunksize: int = 256,
-                    return_best_order: bool = True,
-                    log_dir: Optional[str] = None,
-                    log_time_unit: Optional[float] = None):
+                    with_schedules: bool = False) -> Dict[str, Any]:
     """
-        Главная функция:
-        - iterations: сколько случайных порядков сгенерировать и оценить (в задании: 1\,000\,000).
-        - Определяет workers: если None — берёт число ядер * 2 ограниченное 32.
-        - Параллельно распределяет iterations симуляций между процессами с помощью ProcessPoolExecutor.
-        - Для каждой симуляции обновляет статистику онлайн:
-            * среднее и дисперсию (алгоритм Вельфорда — без хранения всех значений)
-            * минимальное/максимальное значение
-            * reservoir sampling (размер sample_size) — для приближенной медианы без хранения всех iterations
-            * сохраняет лучший найденный порядок (если return_best_order=True)
-        - chunksize: сколько задач слать за раз в map для уменьшения IPC overhead
-        """
-    if iterations <= 0:
-        raise ValueError("iterations must be > 0")
-    task_nodes, task_info, preds_map = prepare_compact_data(tasks)
-    # выбор числа процессов для ProcessPoolExecutor
+        Оценка заданных порядков (например, от внешнего оптимизатора) вместо случайного поиска:
+        - compact: граф в форме prepare_compact_data;
+        - orders: плоский массив — порядки по len(task_nodes) id подряд;
+        - порции по chunksize порядков считаются параллельно в ProcessPoolExecutor (evaluate_chunk);
+        - with_schedules: вернуть ещё времена стартов задач для каждого порядка.
+        Некорректный порядок не прерывает расчёт: его makespan — None, причина — в "errors".
+        Сервер оценивает порядки через calc_scheduler (общий пул процессов).
+    """
+    task_nodes, task_info, preds_map = compact
+    n_tasks = len(task_nodes)
+    batches = order_batches(orders, n_tasks, chunksize)
     if workers is None:
-        cpu = 1
-        try:
-            import os
-            cpu = os.cpu_count() or 1
-        except Exception:
-            cpu = 1
-        workers = max(1, min(32, cpu * 2))
-
-    # статистика (Welford)
-    n = 0
-    mean = 0.0
-    m2 = 0.0
-    min_v = float("inf")
-    max_v = float("-inf")
-    sample = []
-    rng_sample = random.Random(seed_base + 9999)
-    best_makespan = float("inf")
-    best_order = None
-    start_time = time.time()
+        workers = default_workers()
+    from concurrent.futures import ProcessPoolExecutor
 
-    # генератор аргументов для каждого запуска: разные сиды + неизменяемые данные
-    seeds_iter = ((seed_base + i, task_nodes, task_info, preds_map, max_resource) for i in range(iterations))
+    start_time = time.time()
+    args = ((task_info, preds_map, max_resource, orders[start * n_tasks:(start + count) * n_tasks], n_tasks,
+             with_schedules) for start, count in batches)
     with ProcessPoolExecutor(max_workers=workers) as ex:
-        # ex.map распараллеливает вызовы _worker_tuple над seeds_iter
-        for i, res in enumerate(ex.map(_worker_tuple, seeds_iter, chunksize=chunksize)):
-            makespan, order = res
+        chunks = list(ex.map(evaluate_chunk, args))
+    return build_evaluation_result(chunks, max_resource, workers, time.time() - start_time, with_schedules)
+
+
+def default_workers() -> int:
+    # число процессов по умолчанию: число ядер * 2, но не больше 32
+    return max(1, min(32, (os.cpu_count() or 1) * 2))
+
+
+def seed_chunks(iterations: int, seed_base: int, chunksize: int) -> List[Tuple[int, int]]:
+    # разбиение iterations симуляций на порции (seed_start, count)
+    chunksize = max(1, chunksize)
+    return [(seed_base + i, min(chunksize, iterations - i)) for i in range(0, iterations, chunksize)]
+
+
+class SimulationAccumulator:
+    """
+        Онлайн-статистика по потоку makespan'ов:
+        * среднее и дисперсия (алгоритм Вельфорда — без хранения всех значений)
+        * минимальное/максимальное значение
+        * reservoir sampling (размер sample_size) — для приближенной медианы без хранения всех iterations
+        * лучший найденный порядок
+        * для схем выборки antithetic/stratified — моменты средних по блокам (стандартная ошибка)
+        Порции нужно добавлять в порядке seeds — тогда результат не зависит от того,
+        сколько процессов и в каком порядке их считали.
+    """
+
+    def __init__(self, sample_size: int = 10000, seed_base: int = 0, sampling: str = "uniform"):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min_v = float("inf")
+        self.max_v = float("-inf")
+        self.sample_size = sample_size
+        self.sample: List[float] = []
+        self.rng_sample = random.Random(seed_base + 9999)
+        self.best_makespan = float("inf")
+        self.best_order: Optional[List[int]] = None
+        self.sampling = sampling
+        self.unit_moments = _NO_MOMENTS
+
+    def add_chunk(self, makespans: List[float], best_makespan: float, best_order: Optional[List[int]],
+                  unit_moments=None):
+        sample_size = self.sample_size
+        sample = self.sample
+        for makespan in makespans:
+            i = self.n
             # обновляем Welford для среднего и дисперсии
-            n += 1
-            delta = makespan - mean
-            mean += delta / n
-            m2 += delta * (makespan - mean)
-            if makespan < min_v:
-                min_v = makespan
-            if makespan > max_v:
-                max_v = makespan
+            self.n += 1
+            delta = makespan - self.mean
+            self.mean += delta / self.n
+            self.m2 += delta * (makespan - self.mean)
+            if makespan < self.min_v:
+                self.min_v = makespan
+            if makespan > self.max_v:
+                self.max_v = makespan
             # reservoir sampling: храним только sample_size случайных значений из всего потока
             if sample_size > 0:
                 if len(sample) < sample_size:
                     sample.append(makespan)
                 else:
                     # с вероятностью sample_size/(i+1) заменяем случайный элемент
-                    j = rng_sample.randint(0, i)
+                    j = self.rng_sample.randint(0, i)
                     if j < sample_size:
                         sample[j] = makespan
-            # сохраняем лучший порядок
-            if makespan < best_makespan:
-                best_makespan = makespan
-                best_order = order
+        if unit_moments is not None:
+            self.unit_moments = _merge_moments(self.unit_moments, unit_moments)
+        # сохраняем лучший порядок
+        if best_makespan < self.best_makespan:
+            self.best_makespan = best_makespan
+            self.best_order = best_order
+
+    def stderr(self) -> Dict[str, Any]:
+        """
+            Стандартная ошибка среднего с учётом схемы выборки:
+            - stderr_iid — как для независимых симуляций, std / sqrt(n);
+            - stderr — для uniform то же, для antithetic/stratified — по разбросу средних блоков
+              (блоки независимы, симуляции внутри блока — нет);
+            - ci95 — avg ± 1.96 * stderr;
+            - variance_reduction — (stderr_iid / stderr)^2: во сколько раз меньше симуляций
+              нужно схеме для той же ширины интервала, чем независимым порядкам.
+        """
+        n = self.n
+        stderr_iid = math.sqrt(self.m2 / (n - 1) / n) if n > 1 else None
+        if self.sampling == "uniform":
+            stderr = stderr_iid
+        else:
+            units, _, m2 = self.unit_moments[:3]
+            stderr = math.sqrt(m2 / (units - 1) / units) if units > 1 else None
+        return {
+            "stderr": stderr,
+            "stderr_iid": stderr_iid,
+            "ci95": [self.mean - 1.96 * stderr, self.mean + 1.96 * stderr] if stderr is not None else None,
+            "variance_reduction": (stderr_iid / stderr) ** 2 if stderr and stderr_iid is not None else None,
+        }
+
+    def stats(self, elapsed: float) -> Dict[str, Any]:
+        n = self.n
+        stats: Dict[str, Any] = {"avg": None, "std": None}
+        if n > 0:
+            var = self.m2 / n
+            stats["avg"] = self.mean
+            stats["std"] = math.sqrt(var)
+        stats["sampling"] = self.sampling
+        stats.update(self.stderr())
+        stats.update({"min": (self.min_v if n else None), "max": (self.max_v if n else None)})
+        # приближённая медиана по sample (если sample не пуст)
+        median = None
+        sample = sorted(self.sample)
+        if sample:
+            m = len(sample)
+            median = sample[m // 2] if m % 2 == 1 else 0.5 * (sample[m//2 - 1] + sample[m//2])
+        stats["median_approx"] = median
+        stats["sample_size_used"] = len(sample)
+        stats["elapsed_seconds"] = elapsed
+        return stats
+
+
+class PortfolioAccumulator(SimulationAccumulator):
+    """
+        SimulationAccumulator для портфеля: общая статистика — по makespan всего портфеля,
+        плюс по каждому заказу моменты порций сливаются формулой Чана (параллельный Вельфорд).
+    """
 
-    elapsed = time.time() - start_time
-    stats: Dict[str, Any] = {"avg": None, "std": None}
-    if n > 0:
-        var = m2 / n
-        stats["avg"] = mean
-        stats["std"] = math.sqrt(var)
-    stats.update({"min": (min_v if n else None), "max": (max_v if n else None)})
-    # приближённая медиана по sample (если sample не пуст)
-    median = None
-    if sample:
-        sample.sort()
-        m = len(sample)
-        median = sample[m // 2] if m % 2 == 1 else 0.5 * (sample[m//2 - 1] + sample[m//2])
-    stats["median_approx"] = median
-    stats["sample_size_used"] = len(sample)
-    stats["elapsed_seconds"] = elapsed
-
-    result = {"iterations": iterations, "max_resource": max_resource, "workers": workers, "stats": stats}
+    def __init__(self, n_orders: int, sample_size: int = 10000, seed_base: int = 0):
+        super().__init__(sample_size, seed_base)
+        self.order_moments = [_NO_MOMENTS] * n_orders
+
+    def add_chunk(self, makespans: List[float], best_makespan: float, best_order: Optional[List[int]],
+                  order_moments=()):
+        super().add_chunk(makespans, best_makespan, best_order)
+        merged = [_merge_moments(a, b) for a, b in zip(self.order_moments, order_moments)]
+        if merged:
+            self.order_moments = merged
+
+    def order_stats(self) -> List[Dict[str, Any]]:
+        return [{"avg": mean, "std": math.sqrt(m2 / n), "min": min_v, "max": max_v} if n else None
+                for n, mean, m2, min_v, max_v in self.order_moments]
+
+
+def portfolio_order_stats(acc: PortfolioAccumulator, compact: Tuple[List[int], Dict, Dict], max_resource: int,
+                          groups: List[List[int]], offsets: List[float]) -> List[Dict[str, Any]]:
+    # по каждому заказу портфеля: статистика makespan по всем симуляциям и makespan в лучшем расписании
+    best: List[Optional[float]] = [None] * len(groups)
+    if acc.best_order is not None:
+        ends: Dict[int, float] = {}
+        _makespan_for_order(acc.best_order, compact[1], compact[2], max_resource, ends)
+        best = portfolio_makespans(ends, groups, offsets)
+    return [{"makespan": stats, "best_makespan": best_makespan}
+            for stats, best_makespan in zip(acc.order_stats(), best)]
+
+
+def build_simulation_result(acc: SimulationAccumulator,
+                            compact: Tuple[List[int], Dict, Dict],
+                            iterations: int,
+                            max_resource: int,
+                            workers: int,
+                            elapsed: float,
+                            return_best_order: bool = True,
+                            log_dir: Optional[str] = None,
+                            log_time_unit: Optional[float] = None,
+                            timings=None) -> Dict[str, Any]:
+    """
+        Итоговый словарь run_simulations: статистика, лучший порядок (хронология стартов
+        и исходный топологический порядок) и, если запрошено, файл лога лучшего порядка.
+        timings — metrics.StageTimings: сюда добавляется время этапов result и log.
+    """
+    result_start = time.perf_counter()
+    log_seconds = 0.0
+    task_nodes, task_info, preds_map = compact
+    best_order = acc.best_order
+    best_makespan = acc.best_makespan
+    result = {"iterations": iterations, "max_resource": max_resource, "workers": workers,
+              "stats": acc.stats(elapsed)}
     if return_best_order:
         if best_order is None:
             result["best"] = {"makespan": None, "order": None}
@@ -249,6 +744,7 @@ def run_simulations(tasks: List[dict],
 
     # Если запрошен лог — создаём каталог и логируем детально лучший порядок (локально, не из воркеров)
     if log_dir and best_order is not None:
+        log_start = time.perf_counter()
         try:
             os.makedirs(log_dir, exist_ok=True)
             ts = int(time.time())
@@ -274,7 +770,84 @@ def run_simulations(tasks: List[dict],
         except Exception as e:
             # не ломаем основной результат — возвращаем предупреждение в result
             result.setdefault("warnings", []).append(f"failed to write log: {e}")
+        log_seconds = time.perf_counter() - log_start
+
+    if timings is not None:
+        timings.add("log", log_seconds)
+        timings.add("result", time.perf_counter() - result_start - log_seconds)
+    return result
+
+
+def run_simulations(tasks: List[dict],
+                    iterations: int = 1_000_000,
+                    max_resource: int = MAX_RESOURCE_DEFAULT,
+                    workers: Optional[int] = None,
+                    seed_base: int = 0,
+                    sample_size: int = 10000,
+                    chunksize: int = 256,
+                    return_best_order: bool = True,
+                    log_dir: Optional[str] = None,
+                    log_time_unit: Optional[float] = None,
+                    compact: Optional[Tuple[List[int], Dict, Dict]] = None,
+                    sampling: Sampling = "uniform"):
+    """
+        Главная функция:
+        - iterations: сколько случайных порядков сгенерировать и оценить (в задании: 1\,000\,000).
+        - Определяет workers: если None — берёт число ядер * 2 ограниченное 32.
+        - Параллельно распределяет iterations симуляций между процессами с помощью ProcessPoolExecutor,
+          порциями по chunksize seeds (simulate_chunk).
+        - Статистику по порциям собирает SimulationAccumulator (Welford, min/max, reservoir, лучший порядок).
+        - chunksize: сколько симуляций считать в процессе за раз для уменьшения IPC overhead
+        - compact: уже готовый (task_nodes, task_info, preds_map), например из graph_cache —
+          тогда tasks не разбирается повторно
+        - при CALC_STAGE_TIMINGS=1 порции считает simulate_chunk_instrumented, а в результат
+          добавляется "timings" (этапы и пропускная способность процессов; ipc — только в calc_scheduler)
+        - sampling: схема выборки порядков (uniform, antithetic, stratified — см. sampling_unit);
+          iterations округляется вверх до целого числа блоков схемы, в "stats" — stderr с её учётом
+        Сервер запускает расчёты не напрямую, а через calc_scheduler (общий пул процессов);
+        эта функция — для вызова из кода и скриптов.
+        """
+    if iterations <= 0:
+        raise ValueError("iterations must be > 0")
+    if compact is None:
+        compact = prepare_compact_data(tasks)
+    task_nodes, task_info, preds_map = compact
+    # выбор числа процессов для ProcessPoolExecutor
+    if workers is None:
+        workers = default_workers()
+    unit = sampling_unit(task_nodes, preds_map, sampling)
+    iterations, chunksize = align_to_unit(iterations, chunksize, unit)
+
+    # пул процессов (multiprocessing) импортируем только для расчёта — серверу при старте он не нужен
+    from concurrent.futures import ProcessPoolExecutor
 
+    acc = SimulationAccumulator(sample_size, seed_base, sampling)
+    # поэтапные замеры — только если включены (metrics.CALC_STAGE_TIMINGS) и только для uniform
+    timings = metrics.StageTimings() if metrics.CALC_STAGE_TIMINGS and sampling == "uniform" else None
+    start_time = time.time()
+    chunks = ((task_nodes, task_info, preds_map, max_resource, seed_start, count)
+              for seed_start, count in seed_chunks(iterations, seed_base, chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        # ex.map сохраняет порядок порций — статистика совпадает с последовательным расчётом
+        if sampling != "uniform":
+            for chunk in ex.map(simulate_chunk_sampled, (args + (sampling, unit) for args in chunks)):
+                acc.add_chunk(*chunk)
+        elif timings is None:
+            for makespans, best_makespan, best_order in ex.map(simulate_chunk, chunks):
+                acc.add_chunk(makespans, best_makespan, best_order)
+        else:
+            for makespans, best_makespan, best_order, timing, _ in ex.map(simulate_chunk_instrumented, chunks):
+                timings.add_chunk(timing)
+                t0 = time.perf_counter()
+                acc.add_chunk(makespans, best_makespan, best_order)
+                timings.add("aggregate", time.perf_counter() - t0)
+
+    elapsed = time.time() - start_time
+    result = build_simulation_result(acc, compact, iterations, max_resource, workers, elapsed,
+                                     return_best_order, log_dir, log_time_unit, timings)
+    if timings is not None:
+        timings.record()
+        result["timings"] = timings.summary()
     return result
 
 
@@ -288,13 +861,11 @@ def _makespan_for_order_log(order: List[int],
     Исправлено: используем scheduled_end для учёта того, что задача
     не может стартовать до запланированного окончания всех предков.
     """
-    running = []  # heap of (end_time, task_id, resource)
-    resource_in_use = 0
+    profile = _ResourceProfile()
     finish_times: Dict[int, float] = {}
     start_times: Dict[int, float] = {}
     scheduled_end: Dict[int, float] = {}  # плановые окончания для учёта preds
     makespan = 0.0
-    events = []
 
     for tid in order:
         dur, res = task_info[tid]
@@ -305,79 +876,28 @@ def _makespan_for_order_log(order: List[int],
         if missing:
             raise RuntimeError(f"Invalid order: predecessors {missing} for task {tid} are not scheduled before it")
 
-        # earliest — по плановым окончаниям предков
+        # earliest — по плановым окончаниям предков, старт — как в _makespan_for_order
         earliest = max((scheduled_end.get(p, 0.0) for p in preds), default=0.0)
-        t = earliest
-
-        # освобождаем завершившиеся до или в t
-        while running and running[0][0] <= t:
-            end_time, ended_tid, ended_res = heapq.heappop(running)
-            resource_in_use -= ended_res
-            finish_times[ended_tid] = end_time
-            events.append({
-                "time": end_time,
-                "task": ended_tid,
-                "event": "end",
-                "resource": ended_res,
-                "resource_in_use": resource_in_use
-            })
-
-        # если не хватает ресурса — ждем ближайшего завершения(ий)
-        while resource_in_use + res > max_resource and running:
-            end_time, ended_tid, ended_res = heapq.heappop(running)
-            if end_time > t:
-                t = end_time
-            resource_in_use -= ended_res
-            finish_times[ended_tid] = end_time
-            events.append({
-                "time": end_time,
-                "task": ended_tid,
-                "event": "end",
-                "resource": ended_res,
-                "resource_in_use": resource_in_use
-            })
-            while running and running[0][0] <= t:
-                et2, tid2, er2 = heapq.heappop(running)
-                resource_in_use -= er2
-                finish_times[tid2] = et2
-                events.append({
-                    "time": et2,
-                    "task": tid2,
-                    "event": "end",
-                    "resource": er2,
-                    "resource_in_use": resource_in_use
-                })
-
-        # стартуем задачу
-        start = t
+        start = profile.earliest_start(earliest, dur, res, max_resource)
         end = start + dur
         start_times[tid] = start
+        finish_times[tid] = end
         scheduled_end[tid] = end  # сохраняем плановое окончание для предков
         makespan = max(makespan, end)
-        heapq.heappush(running, (end, tid, res))
-        resource_in_use += res
-        events.append({
-            "time": start,
-            "task": tid,
-            "event": "start",
-            "resource": res,
-            "resource_in_use": resource_in_use
-        })
-
-    # очистка оставшихся в running
-    while running:
-        end_time, ended_tid, ended_res = heapq.heappop(running)
-        resource_in_use -= ended_res
-        finish_times[ended_tid] = end_time
-        events.append({
-            "time": end_time,
-            "task": ended_tid,
-            "event": "end",
-            "resource": ended_res,
-            "resource_in_use": resource_in_use
-        })
-
-    events_sorted = sorted(events, key=lambda e: (e["time"], 0 if e["event"] == "end" else 1))
+        profile.add(start, end, res)
+
+    # события по времени и занятый ресурс после каждого: в один момент сначала окончания,
+    # потом старты (задача нулевой длительности — старт раньше своего окончания)
+    events = [{"time": start_times[tid], "task": tid, "event": "start", "resource": task_info[tid][1]}
+              for tid in order]
+    events += [{"time": finish_times[tid], "task": tid, "event": "end", "resource": task_info[tid][1]}
+               for tid in order]
+    events_sorted = sorted(events, key=lambda e: (
+        e["time"], 0 if e["event"] == "end" and start_times[e["task"]] < e["time"] else 1))
+    resource_in_use = 0
+    for e in events_sorted:
+        resource_in_use += e["resource"] if e["event"] == "start" else -e["resource"]
+        e["resource_in_use"] = resource_in_use
 
     # отсортированные списки start/finish по времени
     start_times_sorted = sorted(start_times.items(), key=lambda kv: (kv[1], kv[0]))
@@ -0,0 +1,138 @@
+﻿from typing import Any, Dict, List, Optional, Tuple
+
+from compute_service import _ResourceProfile, _makespan_for_order
+
+
+def _successors(task_nodes: List[int], preds_map: Dict[int, List[int]]) -> Dict[int, List[int]]:
+    succs: Dict[int, List[int]] = {tid: [] for tid in task_nodes}
+    for tid in task_nodes:
+        for p in preds_map.get(tid, ()):
+            succs[p].append(tid)
+    return succs
+
+
+def _topological_order(task_nodes: List[int], preds_map: Dict[int, List[int]],
+                       succs: Dict[int, List[int]]) -> List[int]:
+    # детерминированный Kahn (очередь в порядке task_nodes); граф уже проверен на циклы (graph_cache)
+    indeg = {tid: len(preds_map.get(tid, ())) for tid in task_nodes}
+    order = [tid for tid in task_nodes if indeg[tid] == 0]
+    for tid in order:
+        for s in succs[tid]:
+            indeg[s] -= 1
+            if indeg[s] == 0:
+                order.append(s)
+    if len(order) != len(task_nodes):
+        raise ValueError("task graph contains a cycle")
+    return order
+
+
+def critical_path(compact: Tuple[List[int], Dict, Dict]) -> Dict[str, Any]:
+    """
+        Метод критического пути (CPM) без учёта ресурса за O(V+E):
+        - прямой проход в топологическом порядке: es = max(ef предшественников), ef = es + duration;
+        - обратный проход: lf = min(ls последователей) или длительность проекта, ls = lf - duration;
+        - slack = ls - es (полный резерв), free_slack = min(es последователей) - ef (свободный резерв).
+        Критический путь — цепочка задач с нулевым резервом от старта до окончания проекта
+        (если таких цепочек несколько — первая в порядке task_nodes).
+        Возвращаем {"duration", "critical_path", "tasks": {id: {es, ef, ls, lf, slack, free_slack}}}.
+    """
+    task_nodes, task_info, preds_map = compact
+    succs = _successors(task_nodes, preds_map)
+    topo = _topological_order(task_nodes, preds_map, succs)
+
+    es: Dict[int, float] = {}
+    ef: Dict[int, float] = {}
+    for tid in topo:
+        es[tid] = max((ef[p] for p in preds_map.get(tid, ())), default=0)
+        ef[tid] = es[tid] + task_info[tid][0]
+    duration = max(ef.values(), default=0)
+
+    ls: Dict[int, float] = {}
+    lf: Dict[int, float] = {}
+    for tid in reversed(topo):
+        lf[tid] = min((ls[s] for s in succs[tid]), default=duration)
+        ls[tid] = lf[tid] - task_info[tid][0]
+
+    tasks = {
+        tid: {
+            "es": es[tid], "ef": ef[tid], "ls": ls[tid], "lf": lf[tid],
+            "slack": ls[tid] - es[tid],
+            "free_slack": min((es[s] for s in succs[tid]), default=duration) - ef[tid],
+        }
+        for tid in task_nodes
+    }
+
+    path: List[int] = []
+    tid = next((t for t in task_nodes if ef[t] == duration and tasks[t]["slack"] == 0), None)
+    while tid is not None:
+        path.append(tid)
+        tid = next((p for p in preds_map.get(tid, ()) if ef[p] == es[tid] and tasks[p]["slack"] == 0), None)
+    path.reverse()
+    return {"duration": duration, "critical_path": path, "tasks": tasks}
+
+
+def resource_slack(compact: Tuple[List[int], Dict, Dict], order: List[int], max_resource: int) -> Dict[str, Any]:
+    """
+        Резерв задач в расписании с ограничением ресурса (метод Уиста): расписание порядка order
+        (_makespan_for_order, каждая задача — как можно раньше) и обратный проход — задачи
+        по убыванию окончания сдвигаются как можно позже, не позже старта последователей
+        и makespan, не превышая max_resource вместе с уже сдвинутыми задачами.
+        resource_slack = поздний старт - старт в расписании; задачи с нулевым резервом —
+        критические с учётом ресурса (их задержка сдвигает окончание расписания).
+        Возвращаем {"makespan", "critical_tasks", "tasks": {id: {start, finish, late_start, resource_slack}}}.
+    """
+    task_nodes, task_info, preds_map = compact
+    ends: Dict[int, float] = {}
+    makespan = _makespan_for_order(order, task_info, preds_map, max_resource, ends)
+    succs = _successors(task_nodes, preds_map)
+    position = {tid: i for i, tid in enumerate(order)}
+
+    late_start: Dict[int, float] = {}
+    profile = _ResourceProfile()
+    # последователи заканчиваются позже (или стоят дальше в order) — их поздний старт уже известен
+    for tid in sorted(order, key=lambda t: (ends[t], position[t]), reverse=True):
+        dur, res = task_info[tid]
+        start = ends[tid] - dur
+        latest = min((late_start[s] for s in succs[tid]), default=makespan) - dur
+        # не раньше старта в расписании — резерв не бывает отрицательным
+        t = profile.latest_start(start, latest, dur, res, max_resource)
+        late_start[tid] = t
+        profile.add(t, t + dur, res)
+
+    tasks = {
+        tid: {"start": ends[tid] - task_info[tid][0], "finish": ends[tid], "late_start": late_start[tid],
+              "resource_slack": late_start[tid] - (ends[tid] - task_info[tid][0])}
+        for tid in task_nodes
+    }
+    critical = [tid for tid in order if tasks[tid]["resource_slack"] == 0]
+    return {"makespan": makespan, "critical_tasks": critical, "tasks": tasks}
+
+
+def analyze_order(compact: Tuple[List[int], Dict, Dict], best_order: Optional[List[int]],
+                  max_resource: int) -> Dict[str, Any]:
+    """
+        Аналитика заказа для GET /orders/{id}/analysis: CPM без ресурса (critical_path)
+        и резервы в лучшем найденном расписании с ресурсом (resource_slack), по задачам одним списком
+        в порядке task_nodes.
+    """
+    task_nodes, task_info, _ = compact
+    cpm = critical_path(compact)
+    schedule = resource_slack(compact, best_order, max_resource) if best_order is not None else None
+    tasks = []
+    for tid in task_nodes:
+        dur, res = task_info[tid]
+        row = {"id": tid, "duration": dur, "resource": res, **cpm["tasks"][tid]}
+        row["critical"] = row["slack"] == 0
+        if schedule is not None:
+            row.update(schedule["tasks"][tid])
+        tasks.append(row)
+    return {
+        "duration": cpm["duration"],
+        "critical_path": cpm["critical_path"],
+        "schedule": None if schedule is None else {
+            "makespan": schedule["makespan"],
+            "order": best_order,
+            "critical_tasks": schedule["critical_tasks"],
+        },
+        "tasks": tasks,
+    }
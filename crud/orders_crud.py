@@ -1,39 +1,67 @@
-﻿from typing import Sequence, Optional
+﻿from datetime import date
+from typing import AsyncIterator, Dict, List, Sequence, Optional
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
+import graph_cache
+from crud.tasks_crud import bump_graph_version, task_rows_query
 from models_db import Order, Task
 from schemas import OrderCreate
 
 
-_common_options = [selectinload(Order.tasks).selectinload(Task.preds_rel)]
+# колонки заказа без ORM: ответы строятся из обычных dict (см. tasks_crud.task_rows_query)
+_order_columns = [Order.id, Order.order_name, Order.start_date]
+# сколько id заказов передавать в один IN (...): у asyncpg не больше 32767 параметров на запрос,
+# а список без пагинации (GET /orders/all) отдаёт все заказы разом
+ATTACH_BATCH_SIZE = 1000
 
 
-async def create_order(db: AsyncSession, order_in: OrderCreate) -> Order:
+async def _attach_tasks(db: AsyncSession, orders: List[dict]) -> List[dict]:
+    """
+        Подкладывает заказам задачи (с preds из array_agg) одним запросом на ATTACH_BATCH_SIZE заказов,
+        вместо selectinload(Order.tasks).selectinload(Task.preds_rel) и обхода ORM-объектов.
+    """
+    by_id: Dict[int, dict] = {}
+    for o in orders:
+        o["tasks"] = []
+        by_id[o["id"]] = o
+    ids = list(by_id)
+    for i in range(0, len(ids), ATTACH_BATCH_SIZE):
+        result = await db.execute(
+            task_rows_query().where(Task.order_id.in_(ids[i:i + ATTACH_BATCH_SIZE])).order_by(Task.id)
+        )
+        for row in result.mappings():
+            task = dict(row)
+            # внутри заказа order_id у задач избыточен
+            by_id[task.pop("order_id")]["tasks"].append(task)
+    return orders
+
+
+async def get_start_dates(db: AsyncSession, order_ids: Sequence[int]) -> Dict[int, date]:
+    # даты начала пачки заказов одним запросом; отсутствующих заказов в ответе нет
+    result = await db.execute(select(Order.id, Order.start_date).where(Order.id.in_(list(order_ids))))
+    return {order_id: start_date for order_id, start_date in result}
+
+
+async def create_order(db: AsyncSession, order_in: OrderCreate) -> dict:
     order = Order(order_name=order_in.order_name, start_date=order_in.start_date)
     db.add(order)
     await db.commit()
-    # гарантированно загрузим order вместе с tasks в одной операции до закрытия сессии
-    result = await db.execute(
-        select(Order).options(*_common_options).where(Order.id == order.id)
-    )
-    order_with_tasks = result.scalars().first()
-    return order_with_tasks  # возвращаем объект с загруженными связями
+    # у нового заказа задач ещё нет — ответ собираем сразу, без повторного запроса
+    return {"id": order.id, "order_name": order.order_name, "start_date": order.start_date, "tasks": []}
 
 
-async def update_order(db: AsyncSession, order_id: int, order_in: OrderCreate) -> Optional[Order]:
+async def update_order(db: AsyncSession, order_id: int, order_in: OrderCreate) -> Optional[dict]:
     order = await db.get(Order, order_id)
     if not order:
         return None
     order.order_name = order_in.order_name
     order.start_date = order_in.start_date
+    await bump_graph_version(db, order_id)
     await db.commit()
-    result = await db.execute(
-        select(Order).options(*_common_options).where(Order.id == order.id)
-    )
-    return result.scalars().first()
+    graph_cache.invalidate_order(order_id)
+    return await get_order(db, order_id)
 
 
 async def delete_order(db: AsyncSession, order_id: int) -> bool:
@@ -42,16 +70,54 @@ async def delete_order(db: AsyncSession, order_id: int) -> bool:
         return False
     await db.delete(order)
     await db.commit()
+    graph_cache.invalidate_order(order_id)
     return True
 
 
-async def get_order(db: AsyncSession, order_id: int) -> Optional[Order]:
-    result = await db.execute(
-        select(Order).options(*_common_options).where(Order.id == order_id)
-    )
-    return result.scalars().first()
+async def get_order(db: AsyncSession, order_id: int) -> Optional[dict]:
+    result = await db.execute(select(*_order_columns).where(Order.id == order_id))
+    row = result.mappings().first()
+    if not row:
+        return None
+    orders = await _attach_tasks(db, [dict(row)])
+    return orders[0]
+
+
+def _orders_query(after_id: Optional[int], limit: Optional[int]):
+    # keyset-пагинация по первичному ключу: WHERE id > after_id ORDER BY id LIMIT n
+    stmt = select(*_order_columns).order_by(Order.id)
+    if after_id is not None:
+        stmt = stmt.where(Order.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+async def list_orders(db: AsyncSession,
+                      after_id: Optional[int] = None,
+                      limit: Optional[int] = None,
+                      with_tasks: bool = True) -> Sequence[dict]:
+    result = await db.execute(_orders_query(after_id, limit))
+    orders = [dict(row) for row in result.mappings()]
+    if with_tasks:
+        await _attach_tasks(db, orders)
+    return orders
 
 
-async def list_orders(db: AsyncSession) -> Sequence[Order]:
-    result = await db.execute(select(Order).options(*_common_options))
-    return result.scalars().all()
+async def stream_orders(db: AsyncSession,
+                        after_id: Optional[int] = None,
+                        limit: Optional[int] = None,
+                        with_tasks: bool = True,
+                        batch_size: int = 500) -> AsyncIterator[dict]:
+    """
+        Читает заказы серверным курсором порциями по batch_size (yield_per);
+        задачи подгружаются одним запросом на каждую порцию.
+    """
+    stmt = _orders_query(after_id, limit).execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    async for partition in result.mappings().partitions():
+        orders = [dict(row) for row in partition]
+        if with_tasks:
+            await _attach_tasks(db, orders)
+        for order in orders:
+            yield order
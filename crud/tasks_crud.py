@@ -1,48 +1,169 @@
-﻿from typing import List, Optional, Sequence
-from sqlalchemy import select
+﻿from typing import AsyncIterator, Dict, List, Optional, Sequence
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from models_db import Task, Order
+import graph_cache
+import graph_index
+from models_db import Task, Order, task_pred_table
 
 
-async def create_task(db: AsyncSession, order_id: int, task_in) -> Optional[Task]:
+def task_rows_query(with_preds: bool = True):
+    """
+        Путь чтения без ORM: задачи плоскими строками (id, task, duration, resource, order_id[, preds]).
+        preds собираются прямо в SQL — array_agg по task_pred (LEFT JOIN + GROUP BY),
+        array_remove убирает NULL у задач без предшественников, получаем пустой массив.
+        Так не создаются объекты Task/preds_rel в identity map, а ответ строится из обычных dict.
+    """
+    columns = [Task.id, Task.task, Task.duration, Task.resource, Task.order_id]
+    if not with_preds:
+        return select(*columns)
+    pred_id = task_pred_table.c.pred_id
+    preds = func.array_remove(func.array_agg(aggregate_order_by(pred_id, pred_id)), None)
+    return (
+        select(*columns, preds.label("preds"))
+        .outerjoin(task_pred_table, task_pred_table.c.task_id == Task.id)
+        .group_by(Task.id)
+    )
+
+
+async def bump_graph_version(db: AsyncSession, order_id: int) -> Optional[int]:
+    # вызывается до commit любой записи задач/предшественников заказа: новая версия в БД
+    # становится видна другим процессам вместе с самим изменением; возвращает новую версию.
+    # UPDATE блокирует строку заказа до commit — вызывать до изменения tasks/task_pred,
+    # чтобы все записи заказа брали блокировки в одном порядке (заказ, потом задачи)
+    return await db.scalar(
+        update(Order).where(Order.id == order_id).values(graph_version=Order.graph_version + 1)
+        .returning(Order.graph_version)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def get_order_graph(db: AsyncSession, order_id: int) -> Optional[graph_cache.OrderGraph]:
+    """
+        Компактный граф заказа (как prepare_compact_data) из LRU-кэша по текущей версии из БД;
+        при промахе — одна выборка строк задач с preds из array_agg. None — заказа нет.
+        Версию читаем до строк: строки не старше версии, под которой граф ляжет в кэш.
+    """
+    version = await db.scalar(select(Order.graph_version).where(Order.id == order_id))
+    if version is None:
+        return None
+    graph = graph_cache.cache.get(order_id, version)
+    if graph is None:
+        result = await db.execute(task_rows_query().where(Task.order_id == order_id).order_by(Task.id))
+        graph = graph_cache.build_order_graph(order_id, version, result.mappings().all())
+        graph_cache.cache.put(graph)
+    return graph
+
+
+async def get_order_graphs(db: AsyncSession, order_ids: Sequence[int]) -> Dict[int, graph_cache.OrderGraph]:
+    """
+        Графы нескольких заказов (для портфеля): версии — одним запросом, что есть — из graph_cache,
+        все промахи — одной выборкой строк задач по order_id IN (...), без запроса на каждый заказ.
+        Несуществующих заказов в ответе нет.
+    """
+    result = await db.execute(select(Order.id, Order.graph_version).where(Order.id.in_(list(order_ids))))
+    graphs: Dict[int, graph_cache.OrderGraph] = {}
+    missing: Dict[int, int] = {}
+    for order_id, version in result:
+        graph = graph_cache.cache.get(order_id, version)
+        if graph is None:
+            missing[order_id] = version
+        else:
+            graphs[order_id] = graph
+    if missing:
+        rows: Dict[int, list] = {order_id: [] for order_id in missing}
+        result = await db.execute(
+            task_rows_query().where(Task.order_id.in_(list(missing))).order_by(Task.order_id, Task.id)
+        )
+        for row in result.mappings():
+            rows[row["order_id"]].append(row)
+        for order_id, version in missing.items():
+            graph = graph_cache.build_order_graph(order_id, version, rows[order_id])
+            graph_cache.cache.put(graph)
+            graphs[order_id] = graph
+    return graphs
+
+
+async def _get_order_index(db: AsyncSession, order_id: int, version: int) -> graph_index.OrderGraphIndex:
+    # индекс версии version — из graph_cache, при промахе строится по графу заказа
+    index = graph_cache.cache.get_index(order_id, version)
+    if index is None:
+        graph = await get_order_graph(db, order_id)
+        index = graph_index.build_index(order_id, graph.task_nodes, graph.preds_map)
+        graph_cache.cache.put_index(order_id, graph.version, index, graph_index.index_nbytes(index))
+    return index
+
+
+async def create_task(db: AsyncSession, order_id: int, task_in) -> Optional[dict]:
     order = await db.get(Order, order_id)
     if not order:
         return None
+    # строка заказа блокируется до вставки задачи — тот же порядок блокировок, что в set_task_preds
+    await bump_graph_version(db, order_id)
     task = Task(task=task_in.task, duration=task_in.duration, resource=task_in.resource, order_id=order_id)
     db.add(task)
     await db.commit()
-    result = await db.execute(
-        select(Task).options(selectinload(Task.preds_rel)).where(Task.id == task.id)
-    )
-    return result.scalars().first()
+    graph_cache.invalidate_order(order_id)
+    return await get_task(db, task.id)
 
 
-async def get_task(db: AsyncSession, task_id: int) -> Optional[Task]:
-    result = await db.execute(
-        select(Task).options(selectinload(Task.preds_rel)).where(Task.id == task_id)
-    )
-    return result.scalars().first()
+async def get_task(db: AsyncSession, task_id: int) -> Optional[dict]:
+    result = await db.execute(task_rows_query().where(Task.id == task_id))
+    row = result.mappings().first()
+    return dict(row) if row else None
 
 
-async def list_tasks(db: AsyncSession) -> Sequence[Task]:
-    result = await db.execute(
-        select(Task).options(selectinload(Task.preds_rel))
-    )
-    return result.scalars().all()
+def _tasks_query(after_id: Optional[int], limit: Optional[int], order_id: Optional[int], with_preds: bool):
+    # keyset-пагинация по первичному ключу, опционально — только задачи одного заказа
+    stmt = task_rows_query(with_preds).order_by(Task.id)
+    if order_id is not None:
+        stmt = stmt.where(Task.order_id == order_id)
+    if after_id is not None:
+        stmt = stmt.where(Task.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+async def list_tasks(db: AsyncSession,
+                     after_id: Optional[int] = None,
+                     limit: Optional[int] = None,
+                     order_id: Optional[int] = None,
+                     with_preds: bool = True) -> Sequence[dict]:
+    result = await db.execute(_tasks_query(after_id, limit, order_id, with_preds))
+    return [dict(row) for row in result.mappings()]
+
+
+async def stream_tasks(db: AsyncSession,
+                       after_id: Optional[int] = None,
+                       limit: Optional[int] = None,
+                       order_id: Optional[int] = None,
+                       with_preds: bool = True,
+                       batch_size: int = 1000) -> AsyncIterator[dict]:
+    # серверный курсор порциями по batch_size; строки — обычные dict, identity map не растёт
+    stmt = _tasks_query(after_id, limit, order_id, with_preds).execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    async for row in result.mappings():
+        yield dict(row)
 
 
 async def delete_task(db: AsyncSession, task_id: int) -> bool:
     task = await db.get(Task, task_id)
     if not task:
         return False
+    order_id = task.order_id
+    # сначала строка заказа (UPDATE блокирует её), потом задача и её связи — как в set_task_preds:
+    # иначе DELETE задачи и PATCH, ссылающийся на неё как на предшественника, ждут друг друга
+    await bump_graph_version(db, order_id)
     await db.delete(task)
     await db.commit()
+    graph_cache.invalidate_order(order_id)
     return True
 
 
-async def set_task_preds(db: AsyncSession, task_id: int, pred_ids: List[int]) -> Optional[Task]:
+async def set_task_preds(db: AsyncSession, task_id: int, pred_ids: List[int]) -> Optional[dict]:
     # загрузим саму задачу вместе с уже существующими preds_rel, чтобы избежать ленивого загрузки при присвоении
     result = await db.execute(
         select(Task).options(selectinload(Task.preds_rel)).where(Task.id == task_id)
@@ -53,21 +174,39 @@ async def set_task_preds(db: AsyncSession, task_id: int, pred_ids: List[int]) ->
 
     # подготовим список id (уберём самоссылку и дубликаты)
     filtered_ids = [pid for pid in dict.fromkeys(pred_ids) if pid != task_id]
+    order_id = task.order_id
+    # блокируем строку заказа до commit: проверка и запись предшественников одного заказа идут по очереди
+    # во всех процессах, иначе два параллельных PATCH могут по отдельности пройти проверку и вместе дать цикл.
+    # Версия читается под блокировкой — граф этой версии и есть то, что увидит запись
+    version = await db.scalar(select(Order.graph_version).where(Order.id == order_id).with_for_update())
+    index = None
     if not filtered_ids:
-        task.preds_rel = []
+        preds_objs = []
     else:
         # загружаем только существующие предшественники одним запросом
         preds_result = await db.execute(select(Task).where(Task.id.in_(filtered_ids)))
         preds_objs = preds_result.scalars().all()
         # на всякий случай отфильтруем любые совпадения с task_id
         preds_objs = [p for p in preds_objs if p.id != task_id]
-        # присваиваем найденные объекты
-        task.preds_rel = preds_objs
-
+        # предшественники из чужого заказа не войдут в граф при расчёте — отклоняем
+        foreign = [p.id for p in preds_objs if p.order_id != order_id]
+        if foreign:
+            raise graph_index.ForeignPredError(foreign)
+        # проверка ацикличности по индексу заказа: обходим только потомков task_id
+        index = await _get_order_index(db, order_id, version)
+        cycle = index.find_cycle(task_id, [p.id for p in preds_objs])
+        if cycle:
+            raise graph_index.CycleError(cycle)
+    # присваиваем найденные объекты
+    task.preds_rel = preds_objs
+    new_version = await bump_graph_version(db, order_id)
     await db.commit()
+    graph_cache.invalidate_order(order_id)
+    # под блокировкой других записей заказа не было: новая версия — это старая плюс наш PATCH,
+    # поэтому индекс обновляем точечно и кладём под новой версией, а не строим заново
+    if index is not None:
+        index.set_preds(task_id, [p.id for p in preds_objs])
+        graph_cache.cache.put_index(order_id, new_version, index, graph_index.index_nbytes(index))
 
-    # вернуть свежую версию задачи с подгруженными preds_rel
-    result = await db.execute(
-        select(Task).options(selectinload(Task.preds_rel)).where(Task.id == task.id)
-    )
-    return result.scalars().first()
+    # вернуть свежую версию задачи (preds уже из БД)
+    return await get_task(db, task_id)
@@ -0,0 +1,61 @@
+﻿import json
+import math
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+# orjson — необязательная зависимость (pip install orjson / poetry install -E fast):
+# если её нет, работаем на stdlib json без изменений в API
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+
+def _default(obj: Any):
+    # то, что stdlib json не умеет сам: даты из строк БД
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _finite(obj: Any) -> Any:
+    # NaN/inf -> None, как делает orjson; обход нужен только если такие числа действительно встретились
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False,
+                      default=_default).encode("utf-8")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+        Сериализация в bytes без jsonable_encoder: dict/list/int/float/str/date.
+        orjson в разы быстрее на длинных списках int (порядки задач в результатах расчёта).
+        Без orjson результат тот же: NaN/inf отдаются как null, а не ошибкой.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    try:
+        return _stdlib_dumps(obj)
+    except ValueError:
+        return _stdlib_dumps(_finite(obj))
+
+
+class FastJSONResponse(JSONResponse):
+    """
+        Ответ для данных, которые мы собрали сами (строки из crud, результат run_simulations):
+        FastAPI не прогоняет Response через response_model, поэтому нет повторной
+        валидации и jsonable_encoder — только dumps. response_model в роуте остаётся для документации.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
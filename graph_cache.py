@@ -0,0 +1,184 @@
+﻿import os
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from compute_service import prepare_compact_data
+
+# лимиты кэша — можно переопределить переменными окружения
+GRAPH_CACHE_MAX_BYTES = int(os.environ.get("GRAPH_CACHE_MAX_BYTES", 256 * 2 ** 20))
+GRAPH_CACHE_MAX_ENTRIES = int(os.environ.get("GRAPH_CACHE_MAX_ENTRIES", 1024))
+
+# грубая оценка памяти компактного графа (CPython, 64 бит): вершина — запись в task_nodes,
+# кортеж (duration, resource) в task_info, пустой список в preds_map и ключи словарей; дуга — int в списке
+_BYTES_PER_TASK = 400
+_BYTES_PER_EDGE = 40
+# результат аналитики (cpm.analyze_order): на задачу — словарь из ~12 полей и позиция в порядке расписания
+_ANALYSIS_BYTES_PER_TASK = 1200
+_ANALYSIS_BYTES_BASE = 1000
+
+
+class OrderGraph(NamedTuple):
+    """
+        Компактный граф заказа в форме prepare_compact_data + метаданные для кэша.
+        error — почему граф нельзя считать (цикл, предшественник вне заказа) или None.
+    """
+    order_id: int
+    version: int
+    task_nodes: List[int]
+    task_info: Dict[int, Tuple[int, int]]
+    preds_map: Dict[int, List[int]]
+    nbytes: int
+    error: Optional[str]
+
+    @property
+    def compact(self):
+        return self.task_nodes, self.task_info, self.preds_map
+
+
+def _graph_error(task_nodes: List[int], preds_map: Dict[int, List[int]]) -> Optional[str]:
+    # один проход Kahn при загрузке — дальше результат берётся из кэша вместе с графом
+    nodes = set(task_nodes)
+    foreign = sorted({p for preds in preds_map.values() for p in preds if p not in nodes})
+    if foreign:
+        return f"predecessors {foreign} are not tasks of this order"
+    indeg = {n: len(preds_map[n]) for n in task_nodes}
+    out: Dict[int, List[int]] = {n: [] for n in task_nodes}
+    for t, preds in preds_map.items():
+        for p in preds:
+            out[p].append(t)
+    stack = [n for n, d in indeg.items() if d == 0]
+    seen = 0
+    while stack:
+        node = stack.pop()
+        seen += 1
+        for nbr in out[node]:
+            indeg[nbr] -= 1
+            if indeg[nbr] == 0:
+                stack.append(nbr)
+    if seen != len(task_nodes):
+        cyclic = sorted(n for n, d in indeg.items() if d > 0)
+        return f"task graph contains a cycle through tasks {cyclic}"
+    return None
+
+
+class OrderGraphCache:
+    """
+        LRU-кэш компактных графов заказов, ключ — (order_id, version).
+        version — orders.graph_version из БД: каждая запись через CRUD увеличивает её в той же транзакции,
+        а чтение графа сначала берёт текущую версию из БД (tasks_crud.get_order_graph). Поэтому
+        устаревший граф не выдаётся и при нескольких процессах (uvicorn --workers): запись, сделанная
+        другим процессом, меняет версию в БД. invalidate лишь сразу освобождает память своего процесса.
+        В том же LRU и под тем же лимитом памяти лежат производные структуры заказа той же версии —
+        индекс смежности для проверки циклов (graph_index.OrderGraphIndex) и результаты аналитики
+        (cpm.analyze_order, по параметрам расчёта): они так же сбрасываются при invalidate.
+        Вытеснение — по давности использования, пока не уложимся в max_bytes и max_entries.
+    """
+
+    def __init__(self, max_bytes: int = GRAPH_CACHE_MAX_BYTES, max_entries: int = GRAPH_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # (order_id, version, kind) -> (значение, оценка памяти); kind — "graph", "index" или ("analysis", params)
+        self._entries: "OrderedDict[Tuple[int, int, Any], Tuple[Any, int]]" = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.analysis_hits = 0
+        self.analysis_misses = 0
+
+    def _get(self, key: Tuple[int, int, Any]) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _put(self, key: Tuple[int, int, Any], value: Any, nbytes: int):
+        if nbytes > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self._entries and (self.nbytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.nbytes -= evicted
+            self.evictions += 1
+
+    def get(self, order_id: int, version: int) -> Optional[OrderGraph]:
+        graph = self._get((order_id, version, "graph"))
+        if graph is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return graph
+
+    def put(self, graph: OrderGraph):
+        self._put((graph.order_id, graph.version, "graph"), graph, graph.nbytes)
+
+    def get_index(self, order_id: int, version: int):
+        return self._get((order_id, version, "index"))
+
+    def put_index(self, order_id: int, version: int, index, nbytes: int):
+        self._put((order_id, version, "index"), index, nbytes)
+
+    def get_analysis(self, order_id: int, version: int, params: tuple) -> Optional[Dict[str, Any]]:
+        analysis = self._get((order_id, version, ("analysis", params)))
+        if analysis is None:
+            self.analysis_misses += 1
+            return None
+        self.analysis_hits += 1
+        return analysis
+
+    def put_analysis(self, order_id: int, version: int, params: tuple, analysis: Dict[str, Any]):
+        nbytes = _ANALYSIS_BYTES_BASE + len(analysis["tasks"]) * _ANALYSIS_BYTES_PER_TASK
+        self._put((order_id, version, ("analysis", params)), analysis, nbytes)
+
+    def invalidate(self, order_id: int):
+        # версии в ключах устарели (версия в БД уже больше) — не ждём вытеснения, освобождаем сразу
+        for key in [key for key in self._entries if key[0] == order_id]:
+            self.nbytes -= self._entries.pop(key)[1]
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "analyses": sum(1 for key in self._entries if key[2] not in ("graph", "index")),
+            "analysis_hits": self.analysis_hits,
+            "analysis_misses": self.analysis_misses,
+        }
+
+
+cache = OrderGraphCache()
+
+
+def build_order_graph(order_id: int, version: int, rows) -> OrderGraph:
+    # rows — строки задач заказа (id, duration, resource, preds), см. tasks_crud.task_rows_query
+    task_nodes, task_info, preds_map = prepare_compact_data(rows)
+    n_edges = sum(len(p) for p in preds_map.values())
+    return OrderGraph(
+        order_id=order_id,
+        version=version,
+        task_nodes=task_nodes,
+        task_info=task_info,
+        preds_map=preds_map,
+        nbytes=len(task_nodes) * _BYTES_PER_TASK + n_edges * _BYTES_PER_EDGE,
+        error=_graph_error(task_nodes, preds_map),
+    )
+
+
+def invalidate_order(order_id: Optional[int]):
+    # вызывается из CRUD после любой записи, затрагивающей задачи или атрибуты заказа
+    if order_id is not None:
+        cache.invalidate(order_id)
@@ -0,0 +1,110 @@
+﻿from typing import Dict, Iterable, List, Optional, Set
+
+
+class GraphValidationError(ValueError):
+    """
+        Базовая ошибка валидации графа задач.
+        detail — то, что роутер отдаёт клиенту в HTTPException.
+    """
+
+    def __init__(self, message: str, **extra):
+        super().__init__(message)
+        self.detail = {"message": message, **extra}
+
+
+class CycleError(GraphValidationError):
+    def __init__(self, cycle: List[int]):
+        # cycle: [task_id, ..., pred_id, task_id] — замкнутый путь по дугам pred -> task
+        self.cycle = cycle
+        super().__init__(f"predecessors create a cycle: {' -> '.join(map(str, cycle))}", cycle=cycle)
+
+
+class ForeignPredError(GraphValidationError):
+    def __init__(self, pred_ids: List[int]):
+        self.pred_ids = pred_ids
+        super().__init__(f"predecessors {pred_ids} belong to another order", preds=pred_ids)
+
+
+class OrderGraphIndex:
+    """
+        Индекс смежности графа задач одного заказа (одной версии графа, см. graph_cache):
+        - preds: {task_id: {pred_ids}}
+        - succs: {task_id: {ids задач, для которых task_id — предшественник}}
+        Нужен, чтобы проверять PATCH предшественников без загрузки всего графа из БД каждый раз.
+    """
+
+    def __init__(self, order_id: int):
+        self.order_id = order_id
+        self.preds: Dict[int, Set[int]] = {}
+        self.succs: Dict[int, Set[int]] = {}
+
+    def add_task(self, task_id: int):
+        self.preds.setdefault(task_id, set())
+        self.succs.setdefault(task_id, set())
+
+    def add_edge(self, task_id: int, pred_id: int):
+        self.add_task(task_id)
+        self.add_task(pred_id)
+        self.preds[task_id].add(pred_id)
+        self.succs[pred_id].add(task_id)
+
+    def set_preds(self, task_id: int, pred_ids: Iterable[int]):
+        self.add_task(task_id)
+        for p in self.preds[task_id]:
+            self.succs.get(p, set()).discard(task_id)
+        self.preds[task_id] = set()
+        for p in pred_ids:
+            self.add_edge(task_id, p)
+
+    def find_cycle(self, task_id: int, pred_ids: Iterable[int]) -> Optional[List[int]]:
+        """
+            Проверяет, появится ли цикл, если задать task_id предшественников pred_ids.
+            Новые дуги pred -> task_id замыкают цикл только если pred достижим из task_id по succs,
+            поэтому обходим лишь потомков task_id (затронутый подграф), а не весь заказ.
+            Старые preds task_id — входящие дуги, на потомков не влияют, их можно не убирать.
+            Возвращает цикл [task_id, ..., pred_id, task_id] или None.
+        """
+        targets = set(pred_ids)
+        if not targets:
+            return None
+        if task_id in targets:
+            return [task_id, task_id]
+        parent: Dict[int, int] = {task_id: task_id}
+        stack = [task_id]
+        while stack:
+            node = stack.pop()
+            for nxt in self.succs.get(node, ()):
+                if nxt in parent:
+                    continue
+                parent[nxt] = node
+                if nxt in targets:
+                    # восстанавливаем путь task_id -> ... -> nxt и замыкаем его новой дугой
+                    path = [nxt]
+                    while path[-1] != task_id:
+                        path.append(parent[path[-1]])
+                    path.reverse()
+                    path.append(task_id)
+                    return path
+                stack.append(nxt)
+        return None
+
+
+# грубая оценка памяти индекса для лимита graph_cache: на вершину — два множества и ключи словарей,
+# на дугу — по элементу в preds и в succs
+_BYTES_PER_TASK = 500
+_BYTES_PER_EDGE = 120
+
+
+def build_index(order_id: int, task_nodes: Iterable[int], preds_map: Dict[int, List[int]]) -> OrderGraphIndex:
+    # индекс строится из компактного графа заказа; хранится в graph_cache под версией этого графа
+    index = OrderGraphIndex(order_id)
+    for tid in task_nodes:
+        index.add_task(tid)
+    for tid, preds in preds_map.items():
+        for pid in preds:
+            index.add_edge(tid, pid)
+    return index
+
+
+def index_nbytes(index: OrderGraphIndex) -> int:
+    return len(index.preds) * _BYTES_PER_TASK + sum(map(len, index.preds.values())) * _BYTES_PER_EDGE
@@ -6,12 +6,13 @@ from fastapi import FastAPI, Depends
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db, init_db
-from routers import orders_routers, tasks_routers, calculate_router
+from calc_scheduler import scheduler
+from database import DB_INIT, PRODUCTION, get_db, init_db
+from metrics import LatencyMiddleware
+from routers import orders_routers, tasks_routers, calculate_router, metrics_router
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+async def print_banner():
     # --- Автоопределение IP ---
     def get_local_ip():
         try:
@@ -35,9 +36,32 @@ async def lifespan(app: FastAPI):
     print(f"Redoc:             http://{local_ip}:8000/redoc")
     print("="*60 + "\n")
 
-    # --- Инициализация БД ---
-    await init_db()
+
+async def init_db_background():
+    # схема проверяется после старта: сервер уже принимает запросы, ошибка только логируется
+    try:
+        await init_db()
+    except Exception as e:
+        print(f"Database initialization failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # в production (APP_MODE=production) нет баннера: проба 8.8.8.8 бесполезна в закрытой сети
+    if not PRODUCTION:
+        await print_banner()
+
+    # --- Инициализация БД (DB_INIT: create / background / skip) ---
+    init_task = None
+    if DB_INIT == "create":
+        await init_db()
+    elif DB_INIT == "background":
+        init_task = asyncio.create_task(init_db_background())
     yield
+    if init_task is not None and not init_task.done():
+        init_task.cancel()
+    # останавливаем общий пул процессов расчётов
+    scheduler.shutdown()
 
 # --- Создание приложения ---
 app = FastAPI(
@@ -45,6 +69,8 @@ app = FastAPI(
     title="Мой API",
     version="1.0.0"
 )
+# гистограммы задержек по эндпоинтам для /metrics
+app.add_middleware(LatencyMiddleware)
 
 
 @app.get("/ping-db")
@@ -56,3 +82,4 @@ async def ping_db(db: AsyncSession = Depends(get_db)):
 app.include_router(orders_routers.router)
 app.include_router(tasks_routers.router)
 app.include_router(calculate_router.router)
+app.include_router(metrics_router.router)
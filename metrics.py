@@ -0,0 +1,300 @@
+﻿import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# поэтапные замеры расчётов (порядок / makespan / IPC / слияние / результат) и пропускная
+# способность процессов — по умолчанию выключены: в процессе приходится засекать каждую симуляцию
+CALC_STAGE_TIMINGS = os.environ.get("CALC_STAGE_TIMINGS", "0").lower() in ("1", "true", "yes")
+
+# интервал выборки сэмплирующего профайлера (profiling.StackSampler); здесь, а не в profiling, чтобы роутеры
+# могли объявить параметры, не импортируя профайлер. Меньше ~5 мс смысла нет — поток-сэмплер получает GIL
+# не чаще sys.getswitchinterval()
+PROFILE_DEFAULT_INTERVAL = 0.005
+PROFILE_MIN_INTERVAL = 0.001
+
+# границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _new_child(self):
+        """Ряд метрики для одного набора значений меток."""
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abstractmethod
+    def _samples(self) -> Iterable[str]:
+        """Строки значений всех рядов в текстовом формате Prometheus."""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя — +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class Registry:
+    """
+        Метрики процесса в текстовом формате Prometheus (exposition format 0.0.4) без сторонних библиотек.
+        Счётчики и гистограммы обновляются на горячем пути; collectors — функции, которые
+        в момент запроса /metrics отдают текущие значения (статистика кэша, планировщика, пула БД).
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, str, Callable[[], Optional[dict]], frozenset]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, documentation: str, stats: Callable[[], Optional[dict]],
+                       counters: Sequence[str] = ()):
+        # каждое числовое поле словаря stats() становится gauge <prefix>_<поле>;
+        # поля из counters только растут — они отдаются как counter <prefix>_<поле>_total
+        self._collectors.append((prefix, documentation, stats, frozenset(counters)))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, documentation, stats, counters in self._collectors:
+            try:
+                values = stats() or {}
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                kind = "counter" if key in counters else "gauge"
+                name = f"{prefix}_{key}_total" if kind == "counter" else f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {documentation}: {key}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса до последнего байта ответа",
+    ("method", "route", "status"))
+DB_POOL_CHECKOUT_SECONDS = registry.histogram(
+    "db_pool_checkout_seconds", "Ожидание соединения из пула SQLAlchemy (включая открытие нового)",
+    buckets=POOL_WAIT_BUCKETS)
+CALC_JOB_SECONDS = registry.histogram(
+    "calc_job_seconds", "Длительность расчёта от выдачи первой порции до готовности последней")
+CALC_QUEUE_WAIT_SECONDS = registry.histogram(
+    "calc_queue_wait_seconds", "Ожидание расчёта в очереди планировщика")
+CALC_SIMULATIONS = registry.counter("calc_simulations_total", "Выполнено симуляций")
+CALC_CHUNKS = registry.counter("calc_chunks_total", "Выполнено порций (seeds или заданных порядков)")
+CALC_EVALUATED_ORDERS = registry.counter("calc_evaluated_orders_total", "Оценено заданных порядков")
+CALC_STAGE_SECONDS = registry.counter(
+    "calc_stage_seconds_total",
+    "Время по этапам расчёта: topo_order, makespan (в процессах), ipc, aggregate, result, log",
+    ("stage",))
+# без метки процесса: pid пула меняются при перезапуске процессов и раздували бы число рядов;
+# разбивка по pid есть в timings ответа расчёта
+CALC_WORKER_SIMULATIONS = registry.counter(
+    "calc_worker_simulations_total", "Симуляций в процессах пула (при включённых замерах)")
+CALC_WORKER_BUSY_SECONDS = registry.counter(
+    "calc_worker_busy_seconds_total", "Время счёта порций в процессах пула (при включённых замерах)")
+
+
+class StageTimings:
+    """
+        Поэтапные замеры одного расчёта. Порции приходят из процессов с собственными
+        замерами (simulate_chunk с timing), остальное засекается в родительском процессе.
+        record() переносит итог в глобальные счётчики, summary() — в ответ расчёта.
+    """
+
+    STAGES = ("topo_order", "makespan", "ipc", "aggregate", "result", "log")
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {stage: 0.0 for stage in self.STAGES}
+        self.workers: Dict[int, List[float]] = {}  # pid -> [simulations, busy_seconds]
+
+    def add(self, stage: str, seconds: float):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def add_chunk(self, chunk_timing: dict, round_trip: Optional[float] = None):
+        self.add("topo_order", chunk_timing["topo_order"])
+        self.add("makespan", chunk_timing["makespan"])
+        if round_trip is not None:
+            # всё, что не счёт в процессе: pickle аргументов и результата, передача, ожидание процесса
+            self.add("ipc", max(0.0, round_trip - chunk_timing["wall"]))
+        worker = self.workers.setdefault(chunk_timing["pid"], [0, 0.0])
+        worker[0] += chunk_timing["count"]
+        worker[1] += chunk_timing["wall"]
+
+    def record(self):
+        for stage, seconds in self.seconds.items():
+            CALC_STAGE_SECONDS.labels(stage).inc(seconds)
+        for simulations, busy in self.workers.values():
+            CALC_WORKER_SIMULATIONS.inc(simulations)
+            CALC_WORKER_BUSY_SECONDS.inc(busy)
+
+    def summary(self) -> dict:
+        return {
+            "stages_seconds": dict(self.seconds),
+            "workers": {
+                str(pid): {"simulations": n, "busy_seconds": busy, "per_sec": (n / busy) if busy > 0 else None}
+                for pid, (n, busy) in self.workers.items()
+            },
+        }
+
+
+class LatencyMiddleware:
+    """
+        ASGI middleware: гистограмма длительности запросов по (method, шаблон пути, статус).
+        Шаблон пути (/orders/{order_id}) берётся из сопоставленного роута, чтобы id не
+        раздували число рядов; запросы мимо роутов — route="unmatched".
+        Для потоковых ответов (NDJSON) меряется время до последнего байта.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = 500
+        observed = False
+
+        def observe():
+            nonlocal observed
+            observed = True
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, status).observe(time.perf_counter() - t0)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # записываем до отправки последнего куска: следующий запрос клиента уже видит этот
+                observe()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if not observed:
+                observe()
@@ -18,6 +18,9 @@ class Order(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     order_name = Column(String, nullable=False)
     start_date = Column(Date, nullable=False)
+    # версия графа задач: +1 при каждой записи задач/предшественников (в той же транзакции);
+    # по ней graph_cache любого процесса понимает, что его копия графа устарела
+    graph_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # связь один-ко-многим
     # back_populates указывает на атрибут в классе Task
@@ -39,7 +42,8 @@ class Task(Base):
     resource = Column(Integer, nullable=False)
 
     # внешний ключ на заказ, при удалении заказа удаляются все связанные задачи
-    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"))
+    # индекс — для выборки задач заказа (списки по order_id, граф заказа)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), index=True)
     order = relationship("Order", back_populates="tasks")  # связь многие-к-одному с заказом
 
     # связь многие-ко-многим с предшественниками через промежуточную таблицу
@@ -0,0 +1,81 @@
+﻿import os
+import sys
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from metrics import PROFILE_DEFAULT_INTERVAL, PROFILE_MIN_INTERVAL
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """
+        Сэмплирующий профайлер для одного потока: фоновый поток раз в interval секунд
+        снимает стек целевого потока (sys._current_frames) и считает одинаковые стеки.
+        Результат — collapsed stacks ("корень;...;лист" -> число выборок), формат flamegraph.pl/speedscope.
+        В отличие от cProfile не замедляет каждый вызов, поэтому цифры близки к обычному расчёту.
+
+            with StackSampler() as sampler:
+                work()
+            sampler.stacks
+    """
+
+    def __init__(self, interval: float = PROFILE_DEFAULT_INTERVAL, thread_id: Optional[int] = None):
+        self.interval = max(PROFILE_MIN_INTERVAL, interval)
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+
+    def __enter__(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def summarize(stacks: Dict[str, int], interval: float, top: int = 20) -> dict:
+    """
+        Сводка по collapsed stacks: сколько выборок, топ функций по собственному времени
+        (функция — лист стека) и по включающему (функция есть в стеке).
+    """
+    total = sum(stacks.values())
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, n in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += n
+        for label in set(frames):
+            inclusive[label] += n
+
+    def table(counter: Counter) -> List[dict]:
+        return [{"function": label, "samples": n, "fraction": n / total}
+                for label, n in counter.most_common(top)]
+
+    return {
+        "interval_seconds": interval,
+        "samples": total,
+        "self": table(own) if total else [],
+        "inclusive": table(inclusive) if total else [],
+        "collapsed": dict(stacks),
+    }
@@ -1,8 +1,17 @@
-﻿from fastapi import APIRouter, Query
+﻿from fastapi import APIRouter, Depends, HTTPException, Query
 import random
-import asyncio
 from typing import Optional, List, Dict
-from compute_service import run_simulations
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import graph_cache
+from calc_scheduler import SchedulerBusy, scheduler
+from compute_service import Sampling, merge_portfolio, prepare_compact_data
+from crud import orders_crud, tasks_crud
+from database import get_db
+from fast_json import FastJSONResponse
+from metrics import PROFILE_DEFAULT_INTERVAL, PROFILE_MIN_INTERVAL
+from routers.scheduling import schedule
+from schemas import EvaluateRequest, PortfolioRequest
 
 router = APIRouter(prefix="/calculate", tags=["calculate"])
 
@@ -37,10 +46,14 @@ def generate_random_tasks(n_tasks: int,
 @router.post("/orders/random")
 async def calculate_random_order(n_tasks: int = Query(50, ge=1, le=10000),
                                  iterations: int = Query(1_000_000, ge=1, le=5_000_000),
-                                 workers: Optional[int] = Query(None),
+                                 workers: Optional[int] = Query(None, ge=1, le=scheduler.slots),
                                  max_resource: int = Query(10, gt=0),
                                  seed: Optional[int] = Query(None),  # начальное значение для генерации
-                                 log_time_unit: Optional[int] = Query(None)
+                                 log_time_unit: Optional[int] = Query(None),
+                                 profile: bool = Query(False),
+                                 profile_interval: float = Query(PROFILE_DEFAULT_INTERVAL, ge=PROFILE_MIN_INTERVAL,
+                                                                 le=1.0),
+                                 sampling: Sampling = Query("uniform")
                                  ):
     """
         Эндпоинт:
@@ -49,25 +62,141 @@ async def calculate_random_order(n_tasks: int = Query(50, ge=1, le=10000),
           Текст задания говорит: "создав случайным образом 1000000 последовательностей" — это iterations.
         - workers: число процессов для параллельной оценки (если None — выбирается автоматически).
         - max_resource: ограничение суммарного ресурса одновременно (в задаче = 10).
+        - profile: снять сэмплирующий профиль процессов этого расчёта (раз в profile_interval секунд);
+          в ответ добавляются "profile" (топ функций, collapsed stacks) и "timings" (время по этапам).
+        - sampling: схема выборки порядков — uniform (независимые), antithetic (зеркальные пары),
+          stratified (расслоение первого выбора, до SAMPLING_MAX_STRATA слоёв); в stats — stderr и ci95
+          с учётом схемы, variance_reduction — выигрыш по сравнению с независимыми порядками.
         Внутри мы:
           1) генерируем `tasks`,
-          2) вызываем run_simulations в отдельном потоке (чтобы не блокировать event loop),
+          2) ставим расчёт в calc_scheduler: общий пул процессов, порции seeds делятся
+             между одновременными расчётами по кругу; при переполненной очереди — 429,
           3) получаем агрегированную статистику и лучший порядок.
     """
 
     tasks = generate_random_tasks(n_tasks, seed=seed)
-    # heavy CPU-bound job — запускаем в отдельном потоке, внутри него создаются процессы
-    result_stats = await asyncio.to_thread(
-        run_simulations,
-        tasks,
-        iterations,
-        max_resource,
-        workers,
-        00,       # seed_base — базовый сид для генерации случайных порядков в процессах
-        10000,   # sample_size — сколько значений сохраняем для приближённой медианы (экономия памяти)
-        256,     # chunksize — размер порции работ, передаваемых каждому процессу
-        True,     # return_best_order — возвращать ли лучший найденный порядок
-        log_dir="logs",
-        log_time_unit=log_time_unit
-    )
-    return result_stats
+    result_stats = await schedule(prepare_compact_data(tasks), iterations, max_resource, workers, log_time_unit,
+                                  profile, profile_interval, sampling=sampling)
+    # большие списки int (best.order, order_topological) — сразу в bytes, без jsonable_encoder
+    return FastJSONResponse(result_stats)
+
+
+@router.post("/orders/{order_id}")
+async def calculate_order(order_id: int,
+                          iterations: int = Query(1_000_000, ge=1, le=5_000_000),
+                          workers: Optional[int] = Query(None, ge=1, le=scheduler.slots),
+                          max_resource: int = Query(10, gt=0),
+                          log_time_unit: Optional[int] = Query(None),
+                          profile: bool = Query(False),
+                          profile_interval: float = Query(PROFILE_DEFAULT_INTERVAL, ge=PROFILE_MIN_INTERVAL, le=1.0),
+                          sampling: Sampling = Query("uniform"),
+                          db: AsyncSession = Depends(get_db)):
+    """
+        То же, что /orders/random, но для задач сохранённого заказа.
+        Граф берётся из graph_cache (компактная форма), повторные расчёты не ходят в БД.
+    """
+    graph = await tasks_crud.get_order_graph(db, order_id)
+    if graph is None or not graph.task_nodes:
+        raise HTTPException(status_code=404, detail="order not found or has no tasks")
+    if graph.error:
+        raise HTTPException(status_code=422, detail=graph.error)
+    result_stats = await schedule(graph.compact, iterations, max_resource, workers, log_time_unit,
+                                  profile, profile_interval, sampling=sampling)
+    result_stats["order_id"] = order_id
+    result_stats["graph_version"] = graph.version
+    return FastJSONResponse(result_stats)
+
+
+@router.post("/orders/{order_id}/evaluate")
+async def evaluate_order_sequences(order_id: int,
+                                   request: EvaluateRequest,
+                                   workers: Optional[int] = Query(None, ge=1, le=scheduler.slots),
+                                   max_resource: int = Query(10, gt=0),
+                                   schedules: bool = Query(False),
+                                   db: AsyncSession = Depends(get_db)):
+    """
+        Оценка заданных порядков задач заказа (например, от планировщика или другого оптимизатора)
+        вместо случайного поиска. orders — плоский массив: порядки по n_tasks id задач подряд.
+        Каждый порядок проверяется один раз (все задачи ровно по разу, предшественники раньше),
+        корректные считаются _makespan_for_order в общем пуле процессов.
+        В ответе makespans по номерам порядков (null — порядок некорректен, причина в errors),
+        лучший порядок; schedules=true — ещё времена стартов задач по позициям каждого порядка.
+    """
+    graph = await tasks_crud.get_order_graph(db, order_id)
+    if graph is None or not graph.task_nodes:
+        raise HTTPException(status_code=404, detail="order not found or has no tasks")
+    if graph.error:
+        raise HTTPException(status_code=422, detail=graph.error)
+    try:
+        result = await scheduler.evaluate(graph.compact, request.orders, max_resource, workers,
+                                          with_schedules=schedules)
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    result["order_id"] = order_id
+    return FastJSONResponse(result)
+
+
+@router.post("/portfolio")
+async def calculate_portfolio(request: PortfolioRequest,
+                              iterations: int = Query(100_000, ge=1, le=5_000_000),
+                              workers: Optional[int] = Query(None, ge=1, le=scheduler.slots),
+                              max_resource: int = Query(10, gt=0),
+                              time_units_per_day: float = Query(1.0, gt=0),
+                              log_time_unit: Optional[int] = Query(None),
+                              db: AsyncSession = Depends(get_db)):
+    """
+        Портфель заказов на общем ресурсе: графы заказов объединяются в один (merge_portfolio),
+        задачи заказа не стартуют раньше его start_date — сдвиг от самой ранней даты портфеля
+        в единицах длительности (time_units_per_day на день), а лимит max_resource — общий на все заказы.
+        Графы берутся из graph_cache, промахи догружаются одним запросом на все заказы.
+        В ответе, помимо статистики makespan всего портфеля, "orders": для каждого заказа
+        статистика makespan (от его даты старта до окончания последней задачи) и makespan
+        в лучшем найденном расписании портфеля.
+    """
+    order_ids = list(dict.fromkeys(request.order_ids))
+    start_dates = await orders_crud.get_start_dates(db, order_ids)
+    graphs = await tasks_crud.get_order_graphs(db, order_ids)
+    missing = [order_id for order_id in order_ids if order_id not in start_dates or order_id not in graphs]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"orders not found: {missing}")
+    errors = [f"order {order_id}: {graphs[order_id].error}" for order_id in order_ids if graphs[order_id].error]
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    planned = [order_id for order_id in order_ids if graphs[order_id].task_nodes]
+    if not planned:
+        raise HTTPException(status_code=404, detail="orders have no tasks")
+
+    origin = min(start_dates[order_id] for order_id in planned)
+    offsets = [(start_dates[order_id] - origin).days * time_units_per_day for order_id in planned]
+    compact, groups = merge_portfolio([graphs[order_id].compact for order_id in planned], offsets)
+    result_stats = await schedule(compact, iterations, max_resource, workers, log_time_unit,
+                                  portfolio=(groups, offsets))
+
+    # псевдозадачи "старт заказа" (отрицательные id) в ответе не нужны
+    best = result_stats.get("best")
+    if best and best.get("order") is not None:
+        best["order"] = [tid for tid in best["order"] if tid > 0]
+        best["order_topological"] = [tid for tid in best["order_topological"] if tid > 0]
+    planned_stats = dict(zip(planned, zip(offsets, result_stats.pop("orders"))))
+    orders = []
+    for order_id in order_ids:
+        offset, stats = planned_stats.get(order_id, (None, {"makespan": None, "best_makespan": None}))
+        orders.append({"order_id": order_id, "start_date": start_dates[order_id], "offset": offset,
+                       "n_tasks": len(graphs[order_id].task_nodes), **stats})
+    result_stats["origin_date"] = origin
+    result_stats["orders"] = orders
+    return FastJSONResponse(result_stats)
+
+
+@router.get("/scheduler")
+async def scheduler_stats():
+    # занятые процессы, активные расчёты, глубина очереди, ожидание в очереди
+    return scheduler.stats()
+
+
+@router.get("/cache")
+async def graph_cache_stats():
+    # метрики кэша компактных графов: размер, hit rate, вытеснения, инвалидации
+    return graph_cache.cache.stats()
@@ -0,0 +1,23 @@
+﻿from fastapi import APIRouter
+from fastapi.responses import Response
+
+import database
+import graph_cache
+import metrics
+from calc_scheduler import scheduler
+
+router = APIRouter(tags=["metrics"])
+
+# текущие значения, которые не нужно считать на горячем пути — читаются в момент запроса /metrics
+metrics.registry.register_stats("calc_scheduler", "Состояние планировщика расчётов", scheduler.stats,
+                                counters=("submitted", "completed", "failed", "rejected"))
+metrics.registry.register_stats("graph_cache", "Кэш компактных графов заказов", graph_cache.cache.stats,
+                                counters=("hits", "misses", "evictions", "invalidations",
+                                          "analysis_hits", "analysis_misses"))
+metrics.registry.register_stats("db_pool", "Пул соединений SQLAlchemy", database.pool_stats)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    # текстовый формат Prometheus: задержки эндпоинтов, ожидание пула БД, этапы расчётов, кэш, планировщик
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
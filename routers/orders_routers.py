@@ -1,11 +1,19 @@
-﻿from typing import List
+﻿import asyncio
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from crud import orders_crud
+import cpm
+import graph_cache
+from calc_scheduler import scheduler
+from crud import orders_crud, tasks_crud
 from database import get_db
-from schemas import OrderModel, OrderCreate
+from fast_json import FastJSONResponse
+from routers.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ListFields, ListFormat,
+                                next_cursor_headers, ndjson_response, page_limit)
+from routers.scheduling import schedule
+from schemas import OrderModel, OrderCreate, OrderSummaryModel
 
 
 router = APIRouter(prefix="/orders", tags=["orders"])
@@ -16,9 +24,27 @@ async def create(order_in: OrderCreate, db: AsyncSession = Depends(get_db)):
     return await orders_crud.create_order(db, order_in)
 
 
-@router.get("/all", response_model=List[OrderModel], summary="List all orders")
-async def list_all(db: AsyncSession = Depends(get_db)):
-    return await orders_crud.list_orders(db)
+@router.get("/all", response_model=Union[List[OrderModel], List[OrderSummaryModel]],
+            summary="List orders (keyset pagination)")
+async def list_all(after_id: Optional[int] = Query(None, description="вернуть заказы с id > after_id"),
+                   limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE,
+                                                description=f"размер страницы (с after_id по умолчанию "
+                                                            f"{DEFAULT_PAGE_SIZE}, без after_id и limit — все заказы)"),
+                   fields: ListFields = Query("full", description="summary — без вложенных задач"),
+                   fmt: ListFormat = Query("json", alias="format", description="ndjson — потоковый ответ"),
+                   db: AsyncSession = Depends(get_db)):
+    """
+        Страница заказов, упорядоченных по id. Если страница заполнена, в заголовке X-Next-After-Id
+        приходит курсор для следующего запроса (after_id).
+        format=ndjson отдаёт заказы потоком (по JSON-объекту на строку), читая БД серверным курсором.
+    """
+    with_tasks = fields == "full"
+    if fmt == "ndjson":
+        return ndjson_response(lambda session: orders_crud.stream_orders(session, after_id, limit, with_tasks))
+    limit = page_limit(after_id, limit)
+    orders = await orders_crud.list_orders(db, after_id, limit, with_tasks)
+    # строки из crud уже в форме OrderModel/OrderSummaryModel — отдаём без повторной валидации
+    return FastJSONResponse(orders, headers=next_cursor_headers(orders, limit))
 
 
 @router.get("/{order_id}", response_model=OrderModel, summary="Get an order by ID")
@@ -26,7 +52,43 @@ async def get_one(order_id: int, db: AsyncSession = Depends(get_db)):
     order = await orders_crud.get_order(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="order not found")
-    return order
+    return FastJSONResponse(order)
+
+
+@router.get("/{order_id}/analysis", summary="Critical path and slack of an order")
+async def analysis(order_id: int,
+                   iterations: int = Query(10_000, ge=1, le=1_000_000,
+                                           description="сколько случайных порядков перебрать для лучшего расписания"),
+                   max_resource: int = Query(10, gt=0),
+                   workers: Optional[int] = Query(None, ge=1, le=scheduler.slots),
+                   db: AsyncSession = Depends(get_db)):
+    """
+        Аналитика заказа по компактному графу (cpm.analyze_order):
+        - CPM без учёта ресурса за O(V+E): es/ef/ls/lf, slack и free_slack каждой задачи, критический путь;
+        - резерв с учётом ресурса (resource_slack) в лучшем расписании из iterations случайных порядков
+          (тот же расчёт, что POST /calculate/orders/{id}, через calc_scheduler).
+        Результат хранится в graph_cache рядом с графом — по версии графа и (max_resource, iterations):
+        повторный запрос не пересчитывает, любое изменение задач заказа сбрасывает его.
+        Заказ без задач — пустая аналитика (duration 0, пустой критический путь).
+    """
+    graph = await tasks_crud.get_order_graph(db, order_id)
+    if graph is None:
+        raise HTTPException(status_code=404, detail="order not found")
+    if graph.error:
+        raise HTTPException(status_code=422, detail=graph.error)
+    params = (max_resource, iterations)
+    result = graph_cache.cache.get_analysis(order_id, graph.version, params)
+    cached = result is not None
+    if result is None:
+        best_order = []
+        if graph.task_nodes:
+            # seed_base фиксирован — лучшее расписание для версии графа всегда одно и то же
+            stats = await schedule(graph.compact, iterations, max_resource, workers, sample_size=0, log_dir=None)
+            best_order = stats["best"].get("order_topological")
+        result = await asyncio.to_thread(cpm.analyze_order, graph.compact, best_order, max_resource)
+        graph_cache.cache.put_analysis(order_id, graph.version, params, result)
+    return FastJSONResponse({"order_id": order_id, "graph_version": graph.version, "max_resource": max_resource,
+                             "iterations": iterations, "cached": cached, **result})
 
 
 @router.put("/{order_id}", response_model=OrderModel, summary="Update an existing order")
@@ -0,0 +1,48 @@
+﻿from typing import AsyncIterator, Callable, Dict, Literal, Optional, Sequence
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from fast_json import dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+
+# fields=full — с вложенными задачами/предшественниками, summary — только собственные поля
+ListFields = Literal["full", "summary"]
+# format=json — одна страница списком, ndjson — поток по строке JSON на объект
+ListFormat = Literal["json", "ndjson"]
+
+
+def page_limit(after_id: Optional[int], limit: Optional[int]) -> Optional[int]:
+    # без параметров пагинации список, как и раньше, отдаётся целиком; постранично — только по запросу
+    if limit is None and after_id is not None:
+        return DEFAULT_PAGE_SIZE
+    return limit
+
+
+def next_cursor_headers(items: Sequence, limit: Optional[int]) -> Dict[str, str]:
+    """
+        Keyset-пагинация: если страница заполнена, отдаём id последнего элемента —
+        клиент передаёт его как after_id для следующей страницы.
+    """
+    if limit is None or len(items) < limit:
+        return {}
+    return {NEXT_CURSOR_HEADER: str(items[-1]["id"])}
+
+
+def ndjson_response(open_stream: Callable[[AsyncSession], AsyncIterator[dict]]) -> StreamingResponse:
+    """
+        Потоковый ответ application/x-ndjson.
+        Сессия открывается внутри генератора: зависимость get_db закрывается до отправки тела ответа,
+        а чтение идёт серверным курсором всё время, пока клиент читает поток.
+        Элементы — готовые dict из crud, сериализуются напрямую через fast_json.dumps.
+    """
+    async def body():
+        async with AsyncSessionLocal() as session:
+            async for item in open_stream(session):
+                yield dumps(item) + b"\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
@@ -0,0 +1,40 @@
+﻿from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from calc_scheduler import SchedulerBusy, scheduler
+from compute_service import Sampling
+from metrics import PROFILE_DEFAULT_INTERVAL
+
+
+async def schedule(compact, iterations: int, max_resource: int, workers: Optional[int],
+                   log_time_unit: Optional[int] = None, profile: bool = False,
+                   profile_interval: float = PROFILE_DEFAULT_INTERVAL,
+                   portfolio: Optional[Tuple[List[List[int]], List[float]]] = None,
+                   sampling: Sampling = "uniform",
+                   sample_size: int = 10000,
+                   log_dir: Optional[str] = "logs") -> Dict:
+    """
+        Расчёт случайных порядков через общий calc_scheduler для роутеров (/calculate, /orders/{id}/analysis):
+        несовместимые параметры — 422, заполненная очередь расчётов — 429 с Retry-After.
+    """
+    if profile and sampling != "uniform":
+        # профиль и замеры этапов снимаются только с порций uniform — не отдаём молча ответ без них
+        raise HTTPException(status_code=422, detail="profile is only supported with sampling=uniform")
+    try:
+        return await scheduler.run(
+            compact,
+            iterations,
+            max_resource,
+            workers,
+            seed_base=0,               # базовый сид для генерации случайных порядков в процессах
+            sample_size=sample_size,   # сколько значений сохраняем для приближённой медианы (экономия памяти)
+            return_best_order=True,
+            log_dir=log_dir,
+            log_time_unit=log_time_unit,
+            profile_interval=profile_interval if profile else None,
+            portfolio=portfolio,
+            sampling=sampling
+        )
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
@@ -1,10 +1,14 @@
-﻿from typing import List
+﻿from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import get_db
-from schemas import TaskCreate, TaskModel, PredModel
+from fast_json import FastJSONResponse
+from graph_index import GraphValidationError
+from routers.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ListFields, ListFormat,
+                                next_cursor_headers, ndjson_response, page_limit)
+from schemas import TaskCreate, TaskModel, PredModel, TaskSummaryModel
 import crud.tasks_crud as tasks_crud
 
 
@@ -19,9 +23,26 @@ async def add_task(order_id: int, task_in: TaskCreate, db: AsyncSession = Depend
     return task
 
 
-@router.get("/tasks/all", response_model=List[TaskModel], summary="List all tasks")
-async def list_all_tasks(db: AsyncSession = Depends(get_db)):
-    return await tasks_crud.list_tasks(db)
+@router.get("/tasks/all", response_model=Union[List[TaskModel], List[TaskSummaryModel]],
+            summary="List tasks (keyset pagination)")
+async def list_all_tasks(after_id: Optional[int] = Query(None, description="вернуть задачи с id > after_id"),
+                         limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE,
+                                                      description=f"размер страницы (с after_id по умолчанию "
+                                                                  f"{DEFAULT_PAGE_SIZE}, "
+                                                                  f"без after_id и limit — все задачи)"),
+                         order_id: Optional[int] = Query(None, description="только задачи этого заказа"),
+                         fields: ListFields = Query("full", description="summary — без предшественников"),
+                         fmt: ListFormat = Query("json", alias="format", description="ndjson — потоковый ответ"),
+                         db: AsyncSession = Depends(get_db)):
+    # см. orders_routers.list_all: курсор в X-Next-After-Id, format=ndjson — поток
+    with_preds = fields == "full"
+    if fmt == "ndjson":
+        return ndjson_response(
+            lambda session: tasks_crud.stream_tasks(session, after_id, limit, order_id, with_preds)
+        )
+    limit = page_limit(after_id, limit)
+    tasks = await tasks_crud.list_tasks(db, after_id, limit, order_id, with_preds)
+    return FastJSONResponse(tasks, headers=next_cursor_headers(tasks, limit))
 
 
 @router.get("/tasks/{task_id}", response_model=TaskModel, summary="Get a task by ID")
@@ -29,12 +50,16 @@ async def get_task(task_id: int, db: AsyncSession = Depends(get_db)):
     task = await tasks_crud.get_task(db, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="task not found")
-    return task
+    return FastJSONResponse(task)
 
 
 @router.patch("/tasks/{task_id}", response_model=TaskModel, summary="Set task predecessors")
 async def set_preds(task_id: int, preds_in: PredModel, db: AsyncSession = Depends(get_db)):
-    task = await tasks_crud.set_task_preds(db, task_id, preds_in.pred)
+    try:
+        task = await tasks_crud.set_task_preds(db, task_id, preds_in.pred)
+    except GraphValidationError as e:
+        # цикл или предшественники из другого заказа — граф заказа должен оставаться DAG
+        raise HTTPException(status_code=422, detail=e.detail)
     if task is None:
         raise HTTPException(status_code=404, detail="task not found")
     return task
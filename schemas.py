@@ -1,5 +1,5 @@
 ﻿from pydantic import BaseModel, Field, conint
-from typing import List
+from typing import List, Optional
 from datetime import date
 
 
@@ -19,6 +19,16 @@ class OrderCreate(BaseModel):
     start_date: date
 
 
+class PortfolioRequest(BaseModel):
+    # заказы, которые делят общий лимит ресурса
+    order_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
+
+class EvaluateRequest(BaseModel):
+    # заданные порядки одним плоским массивом: по числу задач графа id подряд на каждый порядок
+    orders: List[int] = Field(..., min_length=1, max_length=10_000_000)
+
+
 # --- Выходные (response) ---
 class TaskModel(BaseModel):
     id: int
@@ -26,6 +36,29 @@ class TaskModel(BaseModel):
     duration: int
     resource: int
     preds: List[int] = Field(default_factory=list)  # создаст пустой список по умолчанию
+    order_id: Optional[int] = None
+
+    class Config:
+        orm_mode = True
+
+
+class TaskSummaryModel(BaseModel):
+    # задача без предшественников — для лёгких списков (fields=summary)
+    id: int
+    task: str
+    duration: int
+    resource: int
+    order_id: Optional[int] = None
+
+    class Config:
+        orm_mode = True
+
+
+class OrderSummaryModel(BaseModel):
+    # заказ без вложенных задач — для лёгких списков (fields=summary)
+    id: int
+    order_name: str
+    start_date: date
 
     class Config:
         orm_mode = True
@@ -0,0 +1,166 @@
+﻿import os
+from datetime import date, timedelta
+
+import faker
+
+SERVICE_HOST = \
+    f"http://{os.environ.get('SERVICE_HOST', '127.0.0.1:8000')}"
+
+fake = faker.Faker()
+
+
+def _create_order_with_chain(api_client, start_date: date, n_tasks: int) -> int:
+    response = api_client.post(
+        url=f"{SERVICE_HOST}/orders",
+        json={"order_name": fake.sentence(nb_words=2), "start_date": start_date.isoformat()}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    order_id = response.json()["id"]
+    prev = None
+    task_ids = []
+    for _ in range(n_tasks):
+        response = api_client.post(
+            url=f"{SERVICE_HOST}/orders/{order_id}/task",
+            json={"task": fake.word(), "duration": 2, "resource": 3}
+        )
+        task_id = response.json()["id"]
+        task_ids.append(task_id)
+        if prev is not None:
+            api_client.patch(f"{SERVICE_HOST}/tasks/{task_id}", json={"pred": [prev]})
+        prev = task_id
+    return order_id, task_ids
+
+
+def test_calculate_order_cache_invalidation(api_client):
+    order_id, _ = _create_order_with_chain(api_client, date.today(), 2)
+    url = f"{SERVICE_HOST}/calculate/orders/{order_id}"
+    params = {"iterations": 10}
+    first = api_client.post(url, params=params).json()
+    before = api_client.get(f"{SERVICE_HOST}/calculate/cache").json()
+    second = api_client.post(url, params=params).json()
+    after = api_client.get(f"{SERVICE_HOST}/calculate/cache").json()
+    assert second["graph_version"] == first["graph_version"]
+    assert second["stats"]["min"] == first["stats"]["min"] == 4
+    assert (after["hits"] - before["hits"], after["misses"] - before["misses"]) == (1, 0)
+
+    # новая задача параллельна цепочке a -> b (ресурса хватает на обе): makespan 5 вместо 4
+    response = api_client.post(
+        url=f"{SERVICE_HOST}/orders/{order_id}/task",
+        json={"task": fake.word(), "duration": 5, "resource": 3}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    third = api_client.post(url, params=params).json()
+    stats = api_client.get(f"{SERVICE_HOST}/calculate/cache").json()
+    assert third["graph_version"] > second["graph_version"]
+    assert third["stats"]["min"] == 5
+    assert (stats["hits"] - after["hits"], stats["misses"] - after["misses"]) == (0, 1)
+    assert stats["invalidations"] - after["invalidations"] == 1
+
+
+def test_calculate_portfolio(api_client):
+    first, _ = _create_order_with_chain(api_client, date.today(), 3)
+    second, _ = _create_order_with_chain(api_client, date.today() + timedelta(days=4), 2)
+    response = api_client.post(
+        f"{SERVICE_HOST}/calculate/portfolio",
+        params={"iterations": 100, "max_resource": 10},
+        json={"order_ids": [first, second]}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    orders = {o["order_id"]: o for o in result["orders"]}
+    # цепочки по 2 единицы: 3 задачи — 6, 2 задачи — 4; второй заказ стартует на 4 дня позже
+    assert orders[first]["makespan"]["avg"] == 6
+    assert orders[second]["offset"] == 4
+    assert orders[second]["makespan"]["avg"] == 4
+    assert result["stats"]["max"] == 8
+    assert all(tid > 0 for tid in result["best"]["order"])
+
+
+def test_calculate_portfolio_unknown_order(api_client):
+    response = api_client.post(f"{SERVICE_HOST}/calculate/portfolio", json={"order_ids": [10 ** 9]})
+    assert response.status_code == 404, f"Unexpected status code: {response.status_code}"
+
+
+def test_calculate_evaluate_orders(api_client):
+    order_id, (a, b, c) = _create_order_with_chain(api_client, date.today(), 3)
+    response = api_client.post(
+        f"{SERVICE_HOST}/calculate/orders/{order_id}/evaluate",
+        params={"schedules": True},
+        json={"orders": [a, b, c, c, b, a]}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    assert result["makespans"] == [6, None]
+    assert [e["index"] for e in result["errors"]] == [1]
+    assert result["schedules"] == [[0, 2, 4], None]
+    response = api_client.post(f"{SERVICE_HOST}/calculate/orders/{order_id}/evaluate", json={"orders": [a, b]})
+    assert response.status_code == 422, f"Unexpected status code: {response.status_code}"
+
+
+def test_calculate_evaluate_respects_max_resource(api_client):
+    response = api_client.post(
+        url=f"{SERVICE_HOST}/orders",
+        json={"order_name": fake.sentence(nb_words=2), "start_date": date.today().isoformat()}
+    )
+    order_id = response.json()["id"]
+    task_ids = []
+    for duration, resource in [(1, 6), (5, 1), (1, 6)]:
+        response = api_client.post(
+            url=f"{SERVICE_HOST}/orders/{order_id}/task",
+            json={"task": fake.word(), "duration": duration, "resource": resource}
+        )
+        task_ids.append(response.json()["id"])
+    a, b, c = task_ids
+    api_client.patch(f"{SERVICE_HOST}/tasks/{b}", json={"pred": [a]})
+    # c стоит в порядке после b, но стартовать вместе с a не может: 6 + 6 > 10
+    response = api_client.post(
+        f"{SERVICE_HOST}/calculate/orders/{order_id}/evaluate",
+        params={"schedules": True, "max_resource": 10},
+        json={"orders": [a, b, c]}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    assert result["schedules"] == [[0, 1, 1]]
+    assert result["makespans"] == [6]
+
+
+def test_calculate_antithetic_sampling(api_client):
+    response = api_client.post(
+        f"{SERVICE_HOST}/calculate/orders/random",
+        params={"n_tasks": 20, "iterations": 101, "seed": 1, "sampling": "antithetic"}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    stats = result["stats"]
+    # пары порядков: iterations округляется до чётного, stderr — по средним пар
+    assert result["iterations"] == 102
+    assert stats["sampling"] == "antithetic"
+    assert stats["stderr"] is not None
+    assert stats["ci95"][0] <= stats["avg"] <= stats["ci95"][1]
+
+
+def test_calculate_rejects_bad_workers(api_client):
+    for workers in (0, -1):
+        response = api_client.post(
+            f"{SERVICE_HOST}/calculate/orders/random",
+            params={"n_tasks": 5, "iterations": 10, "workers": workers}
+        )
+        assert response.status_code == 422, f"Unexpected status code: {response.status_code}"
+
+
+def test_calculate_stratified_sampling(api_client):
+    response = api_client.post(
+        f"{SERVICE_HOST}/calculate/orders/random",
+        params={"n_tasks": 200, "iterations": 100, "seed": 1, "sampling": "stratified"}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    # корней у графа больше SAMPLING_MAX_STRATA: блок — 16 порядков, iterations округляется до кратного
+    assert result["iterations"] == 112
+    assert result["stats"]["sampling"] == "stratified"
+    assert result["stats"]["stderr"] is not None
+    response = api_client.post(
+        f"{SERVICE_HOST}/calculate/orders/random",
+        params={"n_tasks": 20, "iterations": 100, "sampling": "stratified", "profile": True}
+    )
+    assert response.status_code == 422, f"Unexpected status code: {response.status_code}"
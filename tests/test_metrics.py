@@ -0,0 +1,28 @@
+﻿import os
+
+SERVICE_HOST = \
+    f"http://{os.environ.get('SERVICE_HOST', '127.0.0.1:8000')}"
+
+
+def test_metrics_endpoint(api_client):
+    api_client.get(f"{SERVICE_HOST}/orders/all")
+    response = api_client.get(f"{SERVICE_HOST}/metrics")
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/orders/all",status="200"}' in body
+    assert "db_pool_checkout_seconds_count" in body
+    assert "# TYPE graph_cache_hits_total counter" in body
+    assert "calc_scheduler_queue_depth" in body
+
+
+def test_calculate_profile(api_client):
+    response = api_client.post(
+        f"{SERVICE_HOST}/calculate/orders/random",
+        params={"n_tasks": 20, "iterations": 200, "seed": 1, "profile": True, "profile_interval": 0.001}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    assert set(result["timings"]["stages_seconds"]) >= {"topo_order", "makespan", "ipc", "aggregate"}
+    assert sum(w["simulations"] for w in result["timings"]["workers"].values()) == 200
+    assert "collapsed" in result["profile"]
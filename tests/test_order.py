@@ -1,4 +1,5 @@
-﻿import os
+﻿import json
+import os
 from datetime import date
 
 import faker
@@ -31,3 +32,103 @@ def test_order_list_all(api_client):
     )
     print(response.json())
     assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+
+
+def test_order_list_keyset_pagination(api_client):
+    for _ in range(3):
+        api_client.post(
+            url=f"{SERVICE_HOST}/orders",
+            json={"order_name": fake.sentence(nb_words=2), "start_date": date.today().isoformat()}
+        )
+    first = api_client.get(f"{SERVICE_HOST}/orders/all", params={"limit": 2})
+    assert first.status_code == 200, f"Unexpected status code: {first.status_code}"
+    assert len(first.json()) == 2
+    cursor = first.headers.get("X-Next-After-Id")
+    assert cursor == str(first.json()[-1]["id"])
+    second = api_client.get(f"{SERVICE_HOST}/orders/all",
+                            params={"limit": 2, "after_id": cursor, "fields": "summary"})
+    assert second.status_code == 200, f"Unexpected status code: {second.status_code}"
+    assert all(o["id"] > int(cursor) and "tasks" not in o for o in second.json())
+
+
+def test_order_list_all_tasks_in_batches(api_client):
+    # больше ATTACH_BATCH_SIZE (1000) заказов: задачи подгружаются несколькими запросами
+    order_ids = []
+    for _ in range(1001):
+        response = api_client.post(
+            url=f"{SERVICE_HOST}/orders",
+            json={"order_name": fake.sentence(nb_words=2), "start_date": date.today().isoformat()}
+        )
+        order_ids.append(response.json()["id"])
+    first, last = order_ids[0], order_ids[-1]
+    task_ids = {
+        order_id: api_client.post(f"{SERVICE_HOST}/orders/{order_id}/task",
+                                  json={"task": fake.word(), "duration": 2, "resource": 3}).json()["id"]
+        for order_id in (first, last)
+    }
+    response = api_client.get(f"{SERVICE_HOST}/orders/all")
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    orders = {o["id"]: o for o in response.json()}
+    assert set(order_ids) <= set(orders)
+    for order_id, task_id in task_ids.items():
+        assert [t["id"] for t in orders[order_id]["tasks"]] == [task_id]
+    assert orders[order_ids[500]]["tasks"] == []
+
+
+def test_order_list_ndjson(api_client):
+    response = api_client.get(f"{SERVICE_HOST}/orders/all", params={"format": "ndjson"}, stream=True)
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    ids = [json.loads(line)["id"] for line in response.iter_lines() if line]
+    assert ids == sorted(ids)
+
+
+def test_order_analysis(api_client):
+    response = api_client.post(
+        url=f"{SERVICE_HOST}/orders",
+        json={"order_name": fake.sentence(nb_words=2), "start_date": date.today().isoformat()}
+    )
+    order_id = response.json()["id"]
+    a, b, c = [
+        api_client.post(f"{SERVICE_HOST}/orders/{order_id}/task",
+                        json={"task": fake.word(), "duration": 2, "resource": 3}).json()["id"]
+        for _ in range(3)
+    ]
+    api_client.patch(f"{SERVICE_HOST}/tasks/{c}", json={"pred": [a]})
+
+    response = api_client.get(f"{SERVICE_HOST}/orders/{order_id}/analysis", params={"iterations": 50})
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    tasks = {t["id"]: t for t in result["tasks"]}
+    # a -> c по 2 единицы, b параллельно с резервом 2; ресурса (10) хватает всем сразу
+    assert result["duration"] == 4
+    assert result["critical_path"] == [a, c]
+    assert tasks[b]["slack"] == 2 and tasks[b]["resource_slack"] == 2
+    assert result["schedule"]["makespan"] == 4
+    assert result["cached"] is False
+    response = api_client.get(f"{SERVICE_HOST}/orders/{order_id}/analysis", params={"iterations": 50})
+    assert response.json()["cached"] is True
+
+    # ресурса хватает на одну задачу: все идут подряд, резервов нет
+    response = api_client.get(f"{SERVICE_HOST}/orders/{order_id}/analysis",
+                              params={"iterations": 50, "max_resource": 3})
+    result = response.json()
+    assert result["schedule"]["makespan"] == 6
+    assert all(t["resource_slack"] == 0 for t in result["tasks"])
+
+
+def test_order_analysis_empty_and_missing(api_client):
+    response = api_client.post(
+        url=f"{SERVICE_HOST}/orders",
+        json={"order_name": fake.sentence(nb_words=2), "start_date": date.today().isoformat()}
+    )
+    order_id = response.json()["id"]
+    response = api_client.get(f"{SERVICE_HOST}/orders/{order_id}/analysis")
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    result = response.json()
+    assert result["duration"] == 0
+    assert result["critical_path"] == [] and result["tasks"] == []
+    response = api_client.get(f"{SERVICE_HOST}/orders/{10 ** 9}/analysis")
+    assert response.status_code == 404, f"Unexpected status code: {response.status_code}"
+    response = api_client.get(f"{SERVICE_HOST}/orders/{order_id}/analysis", params={"workers": 0})
+    assert response.status_code == 422, f"Unexpected status code: {response.status_code}"
@@ -0,0 +1,112 @@
+﻿import asyncio
+import random
+
+import pytest
+
+from calc_scheduler import CalcScheduler, SchedulerBusy
+from compute_service import prepare_compact_data, run_simulations
+
+ITERATIONS = 2000
+CHUNKSIZE = 50
+
+
+def _random_tasks(n_tasks: int, seed: int):
+    rng = random.Random(seed)
+    return [
+        {"id": tid, "duration": rng.randint(1, 10), "resource": rng.randint(1, 5),
+         "preds": rng.sample(range(1, tid), min(tid - 1, rng.randint(0, 3)))}
+        for tid in range(1, n_tasks + 1)
+    ]
+
+
+def _same_result(result, expected):
+    # время и число процессов у планировщика свои, статистика и лучший порядок — те же
+    drop = {"elapsed_seconds"}
+    assert {k: v for k, v in result["stats"].items() if k not in drop} == \
+        {k: v for k, v in expected["stats"].items() if k not in drop}
+    assert result["best"] == expected["best"]
+
+
+def test_scheduler_admission_and_results():
+    tasks = _random_tasks(30, seed=1)
+    compact = prepare_compact_data(tasks)
+
+    async def scenario():
+        scheduler = CalcScheduler(slots=2, max_active=1, max_queued=1)
+        try:
+            first = asyncio.create_task(scheduler.run(compact, ITERATIONS, 10, seed_base=0, chunksize=CHUNKSIZE))
+            second = asyncio.create_task(scheduler.run(compact, ITERATIONS, 10, seed_base=7, chunksize=CHUNKSIZE))
+            await asyncio.sleep(0)
+            # первый считается, второй ждёт в очереди — третьему места нет
+            assert (scheduler.stats()["active_jobs"], scheduler.stats()["queue_depth"]) == (1, 1)
+            with pytest.raises(SchedulerBusy):
+                await scheduler.run(compact, ITERATIONS, 10, seed_base=14, chunksize=CHUNKSIZE)
+            results = await asyncio.gather(first, second)
+            return results, scheduler.stats()
+        finally:
+            scheduler.shutdown()
+
+    (first, second), stats = asyncio.run(scenario())
+    assert (stats["submitted"], stats["completed"], stats["rejected"]) == (2, 2, 1)
+    for result, seed_base in ((first, 0), (second, 7)):
+        expected = run_simulations(tasks, ITERATIONS, 10, workers=2, seed_base=seed_base, chunksize=CHUNKSIZE,
+                                   compact=compact)
+        _same_result(result, expected)
+
+
+def test_scheduler_round_robin():
+    compact = prepare_compact_data(_random_tasks(30, seed=2))
+
+    async def scenario():
+        scheduler = CalcScheduler(slots=2, max_active=2, max_queued=0)
+        picks = []
+        next_job = scheduler._next_job
+
+        def spy():
+            job = next_job()
+            if job is not None:
+                picks.append(job)
+            return job
+
+        scheduler._next_job = spy
+        try:
+            first = asyncio.create_task(scheduler.run(compact, ITERATIONS, 10, seed_base=0, chunksize=CHUNKSIZE))
+            second = asyncio.create_task(scheduler.run(compact, ITERATIONS, 10, seed_base=7, chunksize=CHUNKSIZE))
+            await asyncio.sleep(0)
+            jobs = list(scheduler._active)
+            await asyncio.gather(first, second)
+            return picks, jobs
+        finally:
+            scheduler.shutdown()
+
+    picks, (first_job, second_job) = asyncio.run(scenario())
+    # первый занял оба процесса до прихода второго, дальше освободившийся процесс получают по очереди
+    assert picks[:2] == [first_job, first_job]
+    assert picks[2:12] == [first_job, second_job] * 5
+
+
+def test_scheduler_cancel_admits_waiting_job():
+    tasks = _random_tasks(30, seed=3)
+    compact = prepare_compact_data(tasks)
+
+    async def scenario():
+        scheduler = CalcScheduler(slots=2, max_active=1, max_queued=1)
+        try:
+            first = asyncio.create_task(scheduler.run(compact, ITERATIONS, 10, seed_base=0, chunksize=CHUNKSIZE))
+            second = asyncio.create_task(scheduler.run(compact, ITERATIONS, 10, seed_base=7, chunksize=CHUNKSIZE))
+            await asyncio.sleep(0)
+            first_job = scheduler._active[0]
+            # клиент ушёл — оставшиеся порции первого не раздаются, очередь переходит ко второму
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            assert not first_job.chunks
+            result = await second
+            return result, scheduler.stats()
+        finally:
+            scheduler.shutdown()
+
+    result, stats = asyncio.run(scenario())
+    assert (stats["completed"], stats["active_jobs"], stats["queue_depth"], stats["busy_slots"]) == (1, 0, 0, 0)
+    _same_result(result, run_simulations(tasks, ITERATIONS, 10, workers=2, seed_base=7, chunksize=CHUNKSIZE,
+                                         compact=compact))
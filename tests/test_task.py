@@ -0,0 +1,61 @@
+﻿import os
+from datetime import date
+
+import faker
+
+SERVICE_HOST = \
+    f"http://{os.environ.get('SERVICE_HOST', '127.0.0.1:8000')}"
+
+fake = faker.Faker()
+
+
+def _create_order(api_client) -> int:
+    response = api_client.post(
+        url=f"{SERVICE_HOST}/orders",
+        json={
+            "order_name": fake.sentence(nb_words=2),
+            "start_date": date.today().isoformat(),
+        }
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    return response.json()["id"]
+
+
+def _create_task(api_client, order_id: int) -> int:
+    response = api_client.post(
+        url=f"{SERVICE_HOST}/orders/{order_id}/task",
+        json={"task": fake.word(), "duration": 2, "resource": 3}
+    )
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    return response.json()["id"]
+
+
+def test_task_set_preds(api_client):
+    order_id = _create_order(api_client)
+    a = _create_task(api_client, order_id)
+    b = _create_task(api_client, order_id)
+    response = api_client.patch(f"{SERVICE_HOST}/tasks/{b}", json={"pred": [a]})
+    assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
+    assert response.json()["preds"] == [a]
+
+
+def test_task_set_preds_rejects_cycle(api_client):
+    order_id = _create_order(api_client)
+    a = _create_task(api_client, order_id)
+    b = _create_task(api_client, order_id)
+    c = _create_task(api_client, order_id)
+    assert api_client.patch(f"{SERVICE_HOST}/tasks/{b}", json={"pred": [a]}).status_code == 200
+    assert api_client.patch(f"{SERVICE_HOST}/tasks/{c}", json={"pred": [b]}).status_code == 200
+    response = api_client.patch(f"{SERVICE_HOST}/tasks/{a}", json={"pred": [c]})
+    print(response.json())
+    assert response.status_code == 422, f"Unexpected status code: {response.status_code}"
+    assert response.json()["detail"]["cycle"] == [a, b, c, a]
+    # предшественники не должны измениться
+    assert api_client.get(f"{SERVICE_HOST}/tasks/{a}").json()["preds"] == []
+
+
+def test_task_set_preds_rejects_foreign_order(api_client):
+    a = _create_task(api_client, _create_order(api_client))
+    b = _create_task(api_client, _create_order(api_client))
+    response = api_client.patch(f"{SERVICE_HOST}/tasks/{b}", json={"pred": [a]})
+    assert response.status_code == 422, f"Unexpected status code: {response.status_code}"